@@ -0,0 +1,153 @@
+import io
+import logging
+import os
+import threading
+import time
+
+from answers import BUDGET_DOCS
+from facts import facts
+from lazy import lazy_import
+from vintages import vintages
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+MIN_OBSERVATIONS = int(os.environ.get('ACCURACY_MIN_OBSERVATIONS', 3))
+BASE_SCENARIOS = ('-', 'Базовый')
+FACT_SHEETS = ['Все'] + [f"{b} {unit}" for b in BUDGET_DOCS.values() for unit in ('трлн руб', '% ВВП')]
+EXPORT_COLUMNS = {'sheet': 'Лист', 'indicator': 'Показатель', 'horizon': 'Горизонт, лет', 'author': 'Автор', 'n': 'Сравнений',
+                  'bias': 'Смещение', 'mae': 'MAE', 'rmse': 'RMSE', 'rank': 'Место'}
+
+
+def facts_long():
+    """
+    Факты в длинном виде: (лист, показатель, год) -> значение
+    """
+    parts = []
+    for sheet in FACT_SHEETS:
+        frame = facts.frame(sheet)
+        years = [c for c in frame.columns if isinstance(c, int)]
+        values = frame[years].apply(pd.to_numeric, errors='coerce').stack()
+        values.index.names = ['indicator', 'target']
+        part = values.rename('fact').reset_index()
+        part['sheet'] = sheet
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
+
+
+def forecast_errors():
+    """
+    Ошибки всех базовых прогнозов корпуса, для которых уже есть факт.
+    Горизонт - число лет между годом документа и годом прогноза (0 - прогноз на текущий год).
+    """
+    df = vintages.frame()
+    df = df[df['scenario'].isin(BASE_SCENARIOS)].copy()
+    df['horizon'] = df['target'] - df['doc_year']
+    df = df[df['horizon'] >= 0]
+    df['sheet'] = np.where(df['unit'] == '', 'Все', df['group'] + ' ' + df['unit'])
+    df = df.merge(facts_long(), on=['sheet', 'indicator', 'target'], how='inner')
+    df['error'] = df['value'] - df['fact']
+    return df
+
+
+def error_stats(errors):
+    """
+    Смещение, MAE и RMSE по (лист, показатель, горизонт, автор) и место автора по RMSE
+    среди авторов с не меньше чем MIN_OBSERVATIONS сравнениями. Лист разделяет бюджеты и единицы Минфина
+    (трлн руб и % ВВП не смешиваются); у остальных авторов он один - 'Все'.
+    """
+    errors = errors.assign(abs_error=errors['error'].abs(), sq_error=errors['error'] ** 2)
+    grouped = errors.groupby(['sheet', 'indicator', 'horizon', 'author'])
+    stats = pd.DataFrame({
+        'n': grouped['error'].count(),
+        'bias': grouped['error'].mean(),
+        'mae': grouped['abs_error'].mean(),
+        'rmse': np.sqrt(grouped['sq_error'].mean()),
+    }).reset_index()
+    stats = stats[stats['n'] >= MIN_OBSERVATIONS].copy()
+    stats['rank'] = stats.groupby(['sheet', 'indicator', 'horizon'])['rmse'].rank(method='min').astype(int)
+    return stats.sort_values(['sheet', 'indicator', 'horizon', 'rank']).reset_index(drop=True)
+
+
+class AccuracyTable:
+    """
+    Точность прогнозов по всему корпусу; пересчитывается при изменении индекса выпусков или фактов
+    """
+
+    def __init__(self):
+        self._stats = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def stats(self, wait=False):
+        """
+        Таблица точности; пока она пересчитывается в другом потоке, возвращается прежняя версия
+        (wait=True - дождаться новой)
+        """
+        version = (vintages.version(), facts.version())
+        if self._version == version:
+            return self._stats
+        if not self._lock.acquire(blocking=wait or self._stats is None):
+            return self._stats
+        try:
+            if self._version != version:
+                started = time.monotonic()
+                errors = forecast_errors()
+                self._stats = error_stats(errors)
+                self._version = version
+                logger.info(f"Accuracy stats built: {len(errors)} forecast/fact pairs, {len(self._stats)} rows "
+                            f"in {time.monotonic() - started:.2f} s")
+            return self._stats
+        finally:
+            self._lock.release()
+
+    def indicator(self, name):
+        stats = self.stats()
+        return stats[stats['indicator'] == name]
+
+    def summary(self):
+        """
+        Сводка по авторам: сколько пар (лист, показатель, горизонт) сравнивалось с другими авторами,
+        в скольких автор точнее всех и его средний ранг
+        """
+        stats = self.stats()
+        competing = stats[stats.groupby(['sheet', 'indicator', 'horizon'])['author'].transform('count') > 1]
+        summary = competing.groupby('author').agg(pairs=('rank', 'size'), wins=('rank', lambda r: int((r == 1).sum())),
+                                                 mean_rank=('rank', 'mean'))
+        return summary.sort_values(['wins', 'mean_rank'], ascending=[False, True]).reset_index()
+
+
+accuracy = AccuracyTable()
+
+
+def _number(value, n=2, sign=False):
+    return (f"{value:+.{n}f}" if sign else f"{value:.{n}f}").replace('.', ',')
+
+
+def indicator_text(name, stats):
+    blocks = [f"Точность прогнозов \"{name}\" (RMSE по базовым сценариям, не меньше {MIN_OBSERVATIONS} сравнений с фактом):"]
+    for (sheet, horizon), table in stats.groupby(['sheet', 'horizon']):
+        header = f"Горизонт {horizon} (прогноз на {'текущий год' if horizon == 0 else f'+{horizon} г.'}):"
+        lines = [header if sheet == 'Все' else f"{sheet}. {header}"]
+        for row in table.itertuples(index=False):
+            lines.append(f"{row.rank}. {row.author}: RMSE {_number(row.rmse)}, смещение {_number(row.bias, sign=True)}, "
+                         f"MAE {_number(row.mae)}, n={row.n}")
+        blocks.append("\n".join(lines))
+    return blocks
+
+
+def summary_text(summary):
+    lines = ["Точность авторов по всем показателям и горизонтам (бюджеты и единицы Минфина - отдельно), "
+             "где есть прогнозы нескольких авторов:"]
+    for i, row in enumerate(summary.itertuples(index=False), 1):
+        lines.append(f"{i}. {row.author}: точнее всех в {row.wins} из {row.pairs}, средний ранг {_number(row.mean_rank, 1)}")
+    lines.append("Подробно по показателю: /accuracy <показатель>")
+    return ["\n".join(lines)]
+
+
+def stats_export(stats):
+    buffer = io.BytesIO()
+    stats[list(EXPORT_COLUMNS)].rename(columns=EXPORT_COLUMNS).to_excel(buffer, index=False)
+    return buffer.getvalue()
@@ -0,0 +1,323 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from cache import file_signature, read_excel
+from catalog import DATA_DIR, catalog
+from facts import facts
+from lazy import lazy_import
+from metrics import registry
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+BUDGET_DOCS = {'Бюджетная система (ОНБП)': 'ОНБП', 'Федеральный бюджет (ФЗоФБ)': 'ФЗоФБ'}
+
+list_var_rpb = ['Импорт товаров', 'Импорт услуг', 'Импорт товаров и услуг',
+                'Финансовый счет (искл. резервы)', 'Сальдо ФС по госсектору',
+                'Сальдо ФС по частному сектору (вкл. ошибки)', 'Сальдо ФС по частному сектору']
+
+
+def vars_dict_from_list(vars_list):
+    vars_dict = result_dict = OrderedDict((item, item) for item in vars_list)
+    replacements = [('Баланс первичных и вторичных доходов', 'Первичные и вторичные доходы'),
+                    ('Финансовый счет (искл. резервы)', 'Финансовый счет'),
+                    ('Финансовый счет (включая резервы)', 'Финансовый счет'),
+                    ('Сальдо ФС по частному сектору (вкл. ошибки)', 'Сальдо ФС по частному сектору'),
+                    ('Сальдо фин. операций частного сектора', 'Сальдо фин. операций частн. сектора'),
+                    ('Чистое приобретение активов, искл. резервы', 'Чистое приобретение активов'),
+                    ('Экспортная цена на российскую нефть', 'Цена на российскую нефть'),
+                    ('Баланс консолидированного бюджета', 'Консолидированный бюджет'),
+                    ('Среднегодовой уровень безработицы', 'Уровень безработицы'),
+                    ('Ставка, ФРС США, верхняя граница диапазона, %, в среднем за год', 'Ставка, ФРС США, среднегодовая'),
+                    ('Ставка, ЕЦБ депозитная, %, в среднем за год', 'Ставка, ЕЦБ, среднегодовая'),
+                    ('Базовые нефтегазовые доходы', 'Баз. нефтегаз. доходы'),
+                    ('Дополнительные нефтегазовые доходы', 'Доп. нефтегаз. доходы')
+                   ]
+    for old, new in replacements:
+        if old in vars_dict:
+            vars_dict[new] = result_dict.pop(old)
+    return result_dict
+
+
+def normalize_balance_of_payments(df):
+    """
+    Переводит платежный баланс в знаки РПБ6: если импорт за год отрицательный,
+    меняет знак у импорта и сальдо финансового счета за этот год
+    """
+    pred_years = list(df.columns)[1:]
+    list_var_change = []
+    vpb_im = None
+    for vpb in df['Показатель']:
+        if vpb in list_var_rpb:
+            list_var_change.append(vpb)
+        if 'Импорт' in vpb:
+            vpb_im = vpb
+    if vpb_im is None:
+        return df
+
+    mask = df['Показатель'].isin(list_var_change)
+    for y in pred_years:
+        if pd.to_numeric(df.loc[df['Показатель'] == vpb_im, y], errors='coerce').iloc[0] < 0:
+            flipped = pd.to_numeric(df.loc[mask, y], errors='coerce') * (-1)
+            if not pd.api.types.is_numeric_dtype(df[y]):
+                df[y] = df[y].astype(object)
+            df.loc[mask, y] = flipped
+    return df
+
+
+def year_of(col):
+    """
+    Год столбца прогноза: 2024 -> 2024, '2018  (оценка)' -> 2018
+    """
+    return int(str(col)[:4])
+
+
+def format_fact(r, n=1):
+    r = round(float(r), n)
+    if n == 0:
+        r = int(r)
+    return str(r).replace('.', ',')
+
+
+class IndicatorEntry:
+    """
+    Показатель документа: строка прогноза, факты за те же годы, округление
+    и готовые строки ответа (без заголовка)
+    """
+
+    def __init__(self, name, forecast, real, rounding, lines):
+        self.name = name
+        self.forecast = forecast
+        self.real = real
+        self.rounding = rounding
+        self.lines = lines
+
+
+def _rows(df):
+    """
+    Возвращает {показатель: {столбец: значение}}; при повторе показателя берется первая строка
+    """
+    rows = {}
+    cols = list(df.columns[1:])
+    for name, values in zip(df.iloc[:, 0], df[cols].itertuples(index=False, name=None)):
+        rows.setdefault(name, dict(zip(cols, values)))
+    return rows
+
+
+def _prior_facts(sheet, name, min_year, n, unit=''):
+    lines = []
+    for y in range(min_year - 3, min_year):
+        if facts.has_column(sheet, y):
+            r = facts.fact(sheet, name, y)
+            if pd.notna(r):
+                lines.append(f"{y}: {format_fact(r, n)}{unit} (факт)")
+    return lines
+
+
+def _short_term_lines(name, row):
+    lines = []
+    cols = list(row)
+    for qi in facts.previous_columns('КСП', cols[0]):
+        r = facts.fact('КСП', name, qi)
+        if pd.notna(r):
+            lines.append(f"{qi}: {format_fact(r)} (факт)")
+    for col in cols:
+        v = str(row[col]).replace('.', ',')
+        r = facts.fact('КСП', name, col)
+        if ('факт' not in v) and pd.notna(r):
+            lines.append(f"{col}: {v} (факт: {format_fact(r)})")
+        else:
+            lines.append(f"{col}: {v}")
+    return lines
+
+
+def _forecast_lines(name, row, n, round_forecast=False):
+    cols = list(row)
+    lines = _prior_facts('Все', name, year_of(cols[0]), n)
+    for col in cols:
+        v = round(float(row[col]), 1) if round_forecast else row[col]
+        v = str(v).replace('.', ',')
+        r = facts.fact('Все', name, year_of(col))
+        if pd.notna(r):
+            lines.append(f"{col}: {v} (факт: {format_fact(r, n)})")
+        else:
+            lines.append(f"{col}: {v}")
+    return lines
+
+
+def _analysts_lines(name, row, n):
+    cols = list(row)
+    min_year = year_of(cols[0])
+    lines = _prior_facts('Все', name, min_year, n)
+    if not facts.has_column('Все', min_year - 1):
+        return lines
+    for col in cols:
+        v = row[col]
+        r = facts.fact('Все', name, year_of(col))
+        if pd.notna(v):
+            v = str(v).replace('.', ',')
+            if pd.notna(r):
+                lines.append(f"{col}: {v} (факт: {format_fact(r, n)})")
+            else:
+                lines.append(f"{col}: {v}")
+        elif pd.notna(r):
+            lines.append(f"{col}: {format_fact(r, n)} (факт)")
+    return lines
+
+
+def _budget_lines(name, row, sheet, unit):
+    cols = list(row)
+    lines = _prior_facts(sheet, name, year_of(cols[0]), 1, unit)
+    for col in cols:
+        v = str(round(float(row[col]), 1)).replace('.', ',')
+        r = facts.fact(sheet, name, year_of(col))
+        if pd.notna(r):
+            lines.append(f"{col}: {v}{unit} (факт: {format_fact(r)})")
+        else:
+            lines.append(f"{col}: {v}{unit}")
+    return lines
+
+
+class DocumentIndex:
+    """
+    Индекс документа (файла набора переменных): название кнопки -> IndicatorEntry.
+    Нормализация знаков платежного баланса и сопоставление с фактами выполняются один раз
+    при построении индекса.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        parts = os.path.normpath(os.path.relpath(path, DATA_DIR)).split(os.sep)
+        self.author = parts[0]
+        self.stem = os.path.splitext(parts[-1])[0]
+        self.short_term = self.stem.split('-')[0] == 'Краткосрочный прогноз'
+        self.balance_of_payments = self.author == 'Банк России' and self.stem == 'Платежный баланс'
+
+        df = read_excel(path)
+        if self.balance_of_payments:
+            df = normalize_balance_of_payments(df)
+        self.columns = list(df.columns[1:])
+        self.vars_dict = vars_dict_from_list(list(df.iloc[:, 0]))
+        self.buttons = list(self.vars_dict.keys())
+        self.entries = OrderedDict()
+        self.rendered = {}
+
+        rows = _rows(df)
+        budget_rows = None
+        if self.author == 'Минфин':
+            b = BUDGET_DOCS[self.stem]
+            budget_rows = [(_rows(read_excel(path, sheet_name="трлн руб")), f'{b} трлн руб', ' трлн руб.'),
+                           (_rows(read_excel(path, sheet_name="% ВВП")), f'{b} % ВВП', ' % ВВП')]
+
+        for button, name in self.vars_dict.items():
+            row = rows[name]
+            n = None
+            if self.short_term:
+                lines = _short_term_lines(name, row)
+                sheet = 'КСП'
+            elif self.author == 'Минфин':
+                lines = []
+                for i, (sheet_rows, sheet, unit) in enumerate(budget_rows):
+                    if i:
+                        lines.append("")
+                    lines += _budget_lines(name, sheet_rows[name], sheet, unit)
+                sheet = budget_rows[0][1]
+            elif self.author == 'Аналитики' and button == "Долгосрочный рост ВВП":
+                lines = [str(row[self.columns[0]]).replace('.', ',')]
+                sheet = None
+            else:
+                n = facts.rounding(name, default=1)
+                sheet = 'Все'
+                if self.author == 'Аналитики':
+                    lines = _analysts_lines(name, row, n)
+                else:
+                    lines = _forecast_lines(name, row, n, round_forecast=self.author == 'МЭР')
+
+            if self.balance_of_payments:
+                lines.append('* В РПБ6')
+
+            real = {}
+            if sheet is not None:
+                real = {col: facts.fact(sheet, name, col if self.short_term else year_of(col)) for col in self.columns}
+            self.entries[button] = IndicatorEntry(name, row, real, n, lines)
+
+    def __getitem__(self, button):
+        return self.entries[button]
+
+    def render(self, button, doc, year, scenario='-'):
+        """
+        Возвращает готовый текст ответа по показателю. Текст зависит только от данных,
+        поэтому хранится в индексе и сбрасывается вместе с ним при изменении файлов.
+        """
+        key = (scenario, button)
+        text = self.rendered.get(key)
+        if text is not None:
+            return text
+        entry = self.entries[button]
+        if doc == 'ОНДКП':
+            header = f"Прогноз \"{entry.name}\" из {doc}-{year} сценария \"{scenario}\":"
+        elif self.author == 'Аналитики':
+            header = f"Прогноз \"{entry.name}\" из прогноза аналитиков перед СД {doc}-{year}:"
+        else:
+            header = f"Прогноз \"{entry.name}\" из {doc}-{year}:"
+        text = "\n".join([header] + entry.lines)
+        self.rendered[key] = text
+        return text
+
+
+_indexes = {}
+_lock = threading.Lock()
+INDEX_REQUESTS = registry.counter('document_index_requests_total', 'Запросы индекса документа: hit - из памяти, miss - построен заново', ['result'])
+registry.callback('document_indexes', 'Индексов документов в памяти', lambda: len(_indexes))
+
+
+def document_index(path):
+    """
+    Возвращает индекс документа; перестраивает его, если изменился файл или Факты.xlsx
+    """
+    signature = (file_signature(path), facts.version())
+    with _lock:
+        cached = _indexes.get(path)
+        if cached is not None and cached[0] == signature:
+            INDEX_REQUESTS.inc(result='hit')
+            return cached[1]
+    INDEX_REQUESTS.inc(result='miss')
+    index = DocumentIndex(path)
+    with _lock:
+        _indexes[path] = (signature, index)
+    logger.info(f"Document index built: {path} ({len(index.entries)} indicators)")
+    return index
+
+
+def refresh_indexes(paths):
+    """
+    Заранее перестраивает уже построенные индексы изменившихся файлов и забывает удаленные
+    """
+    for path in paths:
+        with _lock:
+            cached = path in _indexes
+        if not cached:
+            continue
+        if os.path.exists(path):
+            document_index(path)
+        else:
+            with _lock:
+                _indexes.pop(path, None)
+
+
+def warm_latest_base_forecast(author='Банк России'):
+    """
+    Заранее строит индексы и тексты ответов для последнего базового прогноза
+    """
+    year, doc, doc_item = catalog.latest_base_forecast(author)
+    var_types, _ = catalog.var_types(author, year, doc_item, '-')
+    count = 0
+    for var_group in var_types:
+        index = document_index(catalog.group_path(author, year, doc_item, '-', var_group))
+        for button in index.buttons:
+            index.render(button, doc, year)
+            count += 1
+    logger.info(f"Rendered answers warmed for {doc}-{year}: {count} indicators")
@@ -1,8 +1,10 @@
 from flask import Flask
 from flask import request
+from flask import Response
 from threading import Thread
 import time
 import requests
+from metrics import CONTENT_TYPE, render
 
 
 app = Flask('')
@@ -11,6 +13,10 @@ app = Flask('')
 def home():
   return "I'm alive"
 
+@app.route('/metrics')
+def metrics():
+  return Response(render(), content_type=CONTENT_TYPE)
+
 def run():
   app.run(host='0.0.0.0', port=80)
 
@@ -0,0 +1,317 @@
+"""
+Микробенчмарки слоя данных на настоящем дереве Данные, без Telegram.
+
+Запуск: python bench.py [--save] [--baseline bench_baseline.json] [--threshold 0.25] [-k подстрока]
+Для каждого сценария меряется медиана и минимум времени по --repeat запускам и пиковая память
+(tracemalloc, отдельным запуском). С --save результаты записываются в baseline, без него -
+сравниваются с baseline: если минимальное время (оно меньше всего зависит от шума) или память
+выросли больше чем на threshold, скрипт завершается с кодом 1. Обработчики из main.py вызываются с заглушками update/context.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import answers
+import export
+from answers import document_index, vars_dict_from_list
+from cache import read_excel, workbooks
+from catalog import catalog
+from facts import facts
+
+logger = logging.getLogger(__name__)
+
+BASELINE = os.environ.get('BENCH_BASELINE', 'bench_baseline.json')
+THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', 0.25))
+MIN_DELTA_MS = float(os.environ.get('BENCH_MIN_DELTA_MS', 0.5))
+MIN_RUN_SECONDS = 0.01
+CHAT_ID = 1
+
+
+class Stub:
+    """
+    Заглушка объектов Telegram: атрибуты из kwargs, async-методы возвращают сообщение-заглушку
+    """
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class StubBot:
+    def __init__(self):
+        self.calls = 0
+
+    async def _message(self, **kwargs):
+        self.calls += 1
+        return Stub(message_id=self.calls, chat_id=CHAT_ID, document=None, **kwargs)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self._message(text=text)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return await self._message(text=text)
+
+
+def stub_update(bot, text='', callback_data=None):
+    async def reply(*args, **kwargs):
+        return await bot._message()
+
+    async def noop(*args, **kwargs):
+        return True
+
+    message = Stub(text=text, chat_id=CHAT_ID, message_id=0, reply_markup=None,
+                   reply_text=reply, reply_document=reply)
+    query = Stub(data=callback_data, message=message, answer=noop, delete_message=noop) if callback_data else None
+    user = Stub(id=CHAT_ID, username='bench', first_name='bench')
+    return Stub(message=message, callback_query=query, effective_user=user, effective_chat=Stub(id=CHAT_ID))
+
+
+def latest_groups(author='Банк России'):
+    """
+    Пути групп переменных последнего базового прогноза и его реквизиты
+    """
+    year, doc, doc_item = catalog.latest_base_forecast(author)
+    var_types, _ = catalog.var_types(author, year, doc_item, '-')
+    return year, doc, doc_item, {group: catalog.group_path(author, year, doc_item, '-', group) for group in var_types}
+
+
+def all_documents():
+    for author in catalog.authors():
+        for year in catalog.years(author):
+            for document in catalog.documents(author, year):
+                yield author, year, document
+
+
+def clear_data_caches():
+    workbooks.invalidate()
+    with answers._lock:
+        answers._indexes.clear()
+    with export._lock:
+        export._exports.clear()
+
+
+class Scenario:
+    """
+    Сценарий бенчмарка: run - функция (или корутина при заданном loop), setup - подготовка
+    перед каждым запуском, не входящая в замер (например, сброс кэшей для холодного прогона)
+    """
+
+    def __init__(self, name, run, setup=None, loop=None):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.loop = loop
+        self.number = 1
+
+    def _call(self):
+        if self.loop is not None:
+            self.loop.run_until_complete(self.run())
+        else:
+            self.run()
+
+    def calibrate(self, min_time=MIN_RUN_SECONDS):
+        """
+        Быстрые сценарии без setup повторяются number раз за замер, чтобы замер длился не меньше min_time
+        """
+        elapsed = self.once()
+        if self.setup is None and elapsed < min_time:
+            self.number = math.ceil(min_time / max(elapsed, 1e-6))
+
+    def once(self):
+        """
+        Время одного выполнения, с
+        """
+        if self.setup is not None:
+            self.setup()
+        gc.collect()
+        started = time.perf_counter()
+        for _ in range(self.number):
+            self._call()
+        return (time.perf_counter() - started) / self.number
+
+
+def data_scenarios():
+    year, doc, doc_item, groups = latest_groups()
+    documents = list(all_documents())
+    group_files = [path for _, _, document in documents for groups_ in document.scenarios.values() for path in groups_.values()]
+    first_columns = [list(read_excel(path).iloc[:, 0]) for path in group_files]
+    indexes = [document_index(path) for path in groups.values()]
+
+    def doc_keyboards():
+        for author in catalog.authors():
+            for year_ in catalog.years(author):
+                catalog.doc_keyboard(author, year_)
+
+    def var_types():
+        for author, year_, document in documents:
+            for scenario in document.scenarios:
+                catalog.var_types(author, year_, document.item, scenario)
+
+    def vars_dicts():
+        for column in first_columns:
+            vars_dict_from_list(column)
+
+    def build_indexes():
+        for path in groups.values():
+            document_index(path)
+
+    def forget_rendered():
+        for index in indexes:
+            index.rendered.clear()
+
+    def render_all():
+        for index in indexes:
+            for button in index.buttons:
+                index.render(button, doc, year)
+
+    def export_all():
+        for group, path in groups.items():
+            export.export_bytes(path, balance_of_payments=group == 'Платежный баланс')
+
+    return [
+        Scenario('catalog.doc_keyboard', doc_keyboards),
+        Scenario('catalog.var_types', var_types),
+        Scenario('vars_dict_from_list', vars_dicts),
+        Scenario('document_index.cold', build_indexes, setup=clear_data_caches),
+        Scenario('render.cold', render_all, setup=forget_rendered),
+        Scenario('render.cached', render_all),
+        Scenario('export_bytes.cold', export_all, setup=clear_data_caches),
+        Scenario('export_bytes.cached', export_all),
+    ]
+
+
+def handler_scenarios(loop):
+    """
+    Обработчики main.py целиком: показ выбранных переменных и выгрузка набора в xlsx
+    """
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:bench')
+    import main
+    from outbox import Outbox
+
+    # Лимиты частоты отправки относятся к Telegram, а не к слою данных
+    main.outbox = Outbox(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    year, doc, doc_item, groups = latest_groups()
+    group = 'Реальный сектор' if 'Реальный сектор' in groups else sorted(groups)[0]
+    path = groups[group]
+    bot = StubBot()
+    base = {'author': 'Банк России', 'year': year, 'doc': doc, 'doc_item': doc_item, 'scenario': '-',
+            'var_group': group, 'path': path}
+
+    async def show_selected():
+        context = Stub(bot=bot, user_data=dict(base, var='-', selected_vars=list(document_index(path).buttons)))
+        await main.show_selected_vars(stub_update(bot, callback_data='show_selected'), context)
+
+    async def export_group():
+        context = Stub(bot=bot, user_data=dict(base, var='all', selected_vars=[]))
+        await main.vars_received(stub_update(bot, text=group), context)
+
+    def forget_rendered():
+        document_index(path).rendered.clear()
+
+    return [
+        Scenario('show_selected_vars', show_selected, setup=forget_rendered, loop=loop),
+        Scenario('vars_received.export.cold', export_group, setup=clear_data_caches, loop=loop),
+        Scenario('vars_received.export.cached', export_group, loop=loop),
+    ]
+
+
+def measure(scenario, repeat):
+    scenario.calibrate()
+    times = [scenario.once() for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        if scenario.setup is not None:
+            scenario.setup()
+        tracemalloc.reset_peak()
+        scenario._call()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'median_ms': round(statistics.median(times) * 1000, 3),
+        'min_ms': round(min(times) * 1000, 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Возвращает список регрессий относительно baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        slower = result['min_ms'] - old['min_ms']
+        if slower > MIN_DELTA_MS and result['min_ms'] > old['min_ms'] * (1 + threshold):
+            regressions.append(f"{name}: {old['min_ms']:.2f} -> {result['min_ms']:.2f} ms")
+        if result['peak_kb'] > old['peak_kb'] * (1 + threshold) and result['peak_kb'] - old['peak_kb'] > 64:
+            regressions.append(f"{name}: peak {old['peak_kb']:.0f} -> {result['peak_kb']:.0f} KB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарки слоя данных')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='записать результаты в baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='допустимое ухудшение, доля (0.25 = 25%%)')
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('-k', dest='pattern', default='', help='только сценарии, в названии которых есть подстрока')
+    parser.add_argument('--no-handlers', action='store_true', help='без сценариев с обработчиками main.py')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', force=True)
+    facts.load()
+    catalog.build()
+    loop = asyncio.new_event_loop()
+    scenarios = data_scenarios()
+    if not args.no_handlers:
+        scenarios += handler_scenarios(loop)
+
+    results = {}
+    for scenario in scenarios:
+        if args.pattern not in scenario.name:
+            continue
+        results[scenario.name] = measure(scenario, args.repeat)
+        r = results[scenario.name]
+        print(f"{scenario.name:32} median {r['median_ms']:9.2f} ms   min {r['min_ms']:9.2f} ms   peak {r['peak_kb']:9.1f} KB")
+    loop.close()
+
+    if args.save:
+        data = {'created': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                'repeat': args.repeat, 'scenarios': results}
+        if os.path.exists(args.baseline) and args.pattern:
+            with open(args.baseline, encoding='utf-8') as f:
+                data['scenarios'] = dict(json.load(f)['scenarios'], **results)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save to create one")
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['scenarios']
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions over {args.threshold:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"No regressions over {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
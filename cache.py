@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import store
+from lazy import lazy_import
+from metrics import SHEET_LOAD_SECONDS, SHEET_LOADS, registry
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+
+def file_signature(path):
+    """
+    Возвращает подпись файла (время изменения, размер) для проверки актуальности кэша
+    """
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_sheet(path, sheet_name=0):
+    """
+    Читает лист (или все листы при sheet_name=None) с диска: из колоночного хранилища,
+    а если там нет актуальной копии - из xlsx
+    """
+    started = time.perf_counter()
+    df = store.load(path, sheet_name=sheet_name)
+    source = 'store'
+    if df is None:
+        df = pd.read_excel(path, sheet_name=sheet_name)
+        source = 'xlsx'
+    SHEET_LOADS.inc(source=source)
+    SHEET_LOAD_SECONDS.observe(time.perf_counter() - started, source=source)
+    return df
+
+
+class WorkbookCache:
+    """
+    LRU-кэш прочитанных листов Excel с ключом (путь, лист).
+    Запись считается устаревшей, если у файла изменились время изменения или размер.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def read_excel(self, path, sheet_name=0):
+        """
+        Возвращает копию листа книги: из памяти, если файл не менялся, иначе читает с диска
+        """
+        key = (os.path.normpath(path), sheet_name)
+        signature = file_signature(path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                logger.info(f"Workbook cache hit: {key} - {self.stats_line()}")
+                return entry[1].copy()
+
+        df = load_sheet(path, sheet_name=sheet_name)
+        size = int(df.memory_usage(index=True, deep=True).sum())
+
+        with self._lock:
+            self.misses += 1
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (signature, df, size)
+            self._bytes += size
+            self._evict()
+            logger.info(f"Workbook cache miss: {key} - {self.stats_line()}")
+        return df.copy()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            key, (_, _, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            logger.info(f"Workbook cache eviction: {key}")
+
+    def invalidate(self, path=None):
+        """
+        Удаляет из кэша все листы указанного файла (или весь кэш, если путь не задан)
+        """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._bytes = 0
+                return
+            path = os.path.normpath(path)
+            for key in [k for k in self._entries if k[0] == path]:
+                self._bytes -= self._entries.pop(key)[2]
+
+    def stats_line(self):
+        return (f"hits={self.hits}, misses={self.misses}, evictions={self.evictions}, "
+                f"entries={len(self._entries)}, bytes={self._bytes}")
+
+
+workbooks = WorkbookCache(
+    max_entries=int(os.environ.get('WORKBOOK_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('WORKBOOK_CACHE_MB', 256)) * 1024 * 1024,
+)
+
+
+registry.callback('workbook_cache_hits_total', 'Попадания в кэш листов', lambda: workbooks.hits, 'counter')
+registry.callback('workbook_cache_misses_total', 'Промахи кэша листов', lambda: workbooks.misses, 'counter')
+registry.callback('workbook_cache_evictions_total', 'Вытеснения из кэша листов', lambda: workbooks.evictions, 'counter')
+registry.callback('workbook_cache_entries', 'Листов в кэше', lambda: len(workbooks._entries))
+registry.callback('workbook_cache_bytes', 'Память листов в кэше', lambda: workbooks._bytes)
+
+
+def read_excel(path, sheet_name=0):
+    return workbooks.read_excel(path, sheet_name=sheet_name)
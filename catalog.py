@@ -0,0 +1,253 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'Данные'
+
+month_order = ['Янв', 'Фев', 'Мар', 'Апр', 'Май', 'Июн',
+               'Июл', 'Авг', 'Сен', 'Окт', 'Ноя', 'Дек']
+
+
+class Document:
+    """
+    Документ с прогнозом: название кнопки (label), имя папки/файла (item) и наборы переменных.
+    Для ОНДКП наборы переменных лежат по сценариям, для остальных документов scenario = '-'.
+    """
+
+    def __init__(self, label, item, path, order=0):
+        self.label = label
+        self.item = item
+        self.path = path
+        self.order = order
+        self.scenarios = {}
+
+    def groups(self, scenario='-'):
+        return self.scenarios.get(scenario, {})
+
+
+def _groups(directory):
+    """
+    Возвращает наборы переменных папки: {название набора: путь к файлу}
+    """
+    return {item.split('.')[0]: f"{directory}/{item}" for item in os.listdir(directory)}
+
+
+def _rows(items, n):
+    return [items[i:i+n] for i in range(0, len(items), n)]
+
+
+class Catalog:
+    """
+    Каталог дерева Данные: автор -> год -> документ -> сценарий -> набор переменных -> файл.
+    Строится один раз при запуске; при изменении папок перестраиваются только затронутые годы
+    (проверка не чаще, чем раз в refresh_interval секунд; при refresh_interval = None -
+    только по вызову build, например из watcher). Новые годы подменяются одним присваиванием.
+    """
+
+    def __init__(self, root=DATA_DIR, refresh_interval=60):
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self._years = {}
+        self._snapshot = {}
+        self._checked = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def build(self):
+        with self._lock:
+            self._refresh()
+            self._checked = time.monotonic()
+
+    def _ensure_fresh(self):
+        if self._checked is not None and (self.refresh_interval is None or time.monotonic() - self._checked < self.refresh_interval):
+            return
+        self.build()
+
+    def mark_changed(self):
+        """
+        Увеличивает версию, когда изменилось содержимое файлов без изменения папок
+        (вызывается наблюдателем за деревом Данные)
+        """
+        with self._lock:
+            self._version += 1
+
+    def _take_snapshot(self):
+        """
+        Возвращает {(автор, год): время изменения всех папок года} для поиска изменившихся годов
+        """
+        snapshot = {}
+        if not os.path.exists(self.root):
+            raise FileNotFoundError(f"Директория '{self.root}' не существует")
+        for author in os.scandir(self.root):
+            if not author.is_dir():
+                continue
+            for year in os.scandir(author.path):
+                if not year.is_dir():
+                    continue
+                mtimes = []
+                for dirpath, dirnames, _ in os.walk(year.path):
+                    mtimes.append((dirpath, os.stat(dirpath).st_mtime_ns))
+                snapshot[(author.name, year.name)] = tuple(sorted(mtimes))
+        return snapshot
+
+    def _refresh(self):
+        snapshot = self._take_snapshot()
+        years = dict(self._years)
+        changed = [key for key, sig in snapshot.items() if self._snapshot.get(key) != sig]
+        removed = [key for key in years if key not in snapshot]
+        for key in removed:
+            del years[key]
+        for author, year in changed:
+            years[(author, year)] = self._build_year(author, year)
+        self._years = years
+        self._snapshot = snapshot
+        if changed or removed:
+            self._version += 1
+            logger.info(f"Catalog updated: {len(changed)} years rebuilt, {len(removed)} removed, {len(years)} total")
+
+    def _build_year(self, author, year):
+        directory = f"{self.root}/{author}/{year}"
+        docs = []
+        keyboard = []
+
+        if author == "Банк России":
+            base_docs = []
+            short_docs = []
+            for item in os.listdir(directory):
+                full_path = f"{directory}/{item}"
+                if os.path.isdir(full_path) and item == 'ОНДКП':
+                    doc = Document(item, item, full_path)
+                    for scenario in os.listdir(full_path):
+                        if os.path.isdir(f"{full_path}/{scenario}"):
+                            doc.scenarios[scenario] = _groups(f"{full_path}/{scenario}")
+                    docs.append(doc)
+                    keyboard = keyboard + [[item]]
+                elif os.path.isdir(full_path) and 'Базовый прогноз' in item.partition('-')[0]:
+                    doc = Document(item.split('-')[0] + '-' + item.split('-')[2].split('.')[0], item, full_path, int(item.split('-')[1]) - 1)
+                    doc.scenarios['-'] = _groups(full_path)
+                    base_docs.append(doc)
+                elif item.partition('-')[0] == 'Краткосрочный прогноз':
+                    doc = Document(item.split('-')[0] + '-' + item.split('-')[2].split('.')[0], item, full_path, int(item.split('-')[1]) - 1)
+                    short_docs.append(doc)
+            base_docs = sorted(base_docs, key=lambda x: x.order)
+            short_docs = sorted(short_docs, key=lambda x: x.order)
+            docs = docs + base_docs + short_docs
+            keyboard = keyboard + _rows([d.label for d in base_docs], 2) + _rows([d.label for d in short_docs], 2)
+
+        elif author == "Минфин":
+            for item in sorted(os.listdir(directory)):
+                docs.append(Document(item.split('.')[0], item, f"{directory}/{item}"))
+            keyboard = [[d.label] for d in docs]
+
+        elif author == "МЭР":
+            for item in sorted(os.listdir(directory), key=lambda x: x.split('.')[0]):
+                doc = Document(item.split('.')[0], item, f"{directory}/{item}")
+                doc.scenarios['-'] = _groups(doc.path)
+                docs.append(doc)
+            keyboard = [[d.label] for d in docs]
+
+        elif author == "Аналитики":
+            for item in sorted(os.listdir(directory), key=lambda x: month_order.index(x)):
+                doc = Document(item, item, f"{directory}/{item}", month_order.index(item))
+                doc.scenarios['-'] = _groups(doc.path)
+                docs.append(doc)
+            keyboard = _rows([d.label for d in docs], 4)
+
+        return {
+            'docs': {d.label: d for d in docs},
+            'items': {d.item: d for d in docs},
+            'keyboard': keyboard,
+        }
+
+    def version(self):
+        """
+        Номер версии каталога: увеличивается при каждом изменении дерева Данные
+        """
+        self._ensure_fresh()
+        return self._version
+
+    def documents(self, author, year):
+        """
+        Возвращает документы автора за год в порядке клавиатуры
+        """
+        return list(self._year(author, year)['docs'].values())
+
+    def _year(self, author, year):
+        self._ensure_fresh()
+        entry = self._years.get((author, year))
+        if entry is None:
+            raise FileNotFoundError(f"Директория '{self.root}/{author}/{year}' не существует")
+        return entry
+
+    def authors(self):
+        """
+        Возвращает отсортированный список авторов прогнозов
+        """
+        self._ensure_fresh()
+        return sorted({author for author, _ in self._years})
+
+    def years(self, author):
+        """
+        Возвращает годы документов автора по убыванию
+        """
+        self._ensure_fresh()
+        return list(map(str, sorted((int(y) for a, y in self._years if a == author), reverse=True)))
+
+    def doc_keyboard(self, author, year):
+        """
+        Возвращает клавиатуру с названиями документов за год
+        """
+        return [list(row) for row in self._year(author, year)['keyboard']]
+
+    def document(self, author, year, doc_item):
+        return self._year(author, year)['items'].get(doc_item)
+
+    def doc_item(self, author, year, doc):
+        """
+        Возвращает имя папки/файла документа по названию кнопки
+        """
+        document = self._year(author, year)['docs'].get(doc)
+        return document.item if document is not None else None
+
+    def scenarios(self, author, year):
+        """
+        Возвращает отсортированный список сценариев ОНДКП
+        """
+        document = self._year(author, year)['docs'].get('ОНДКП')
+        return sorted(document.scenarios) if document is not None else []
+
+    def var_types(self, author, year, doc_item, scenario):
+        """
+        Возвращает отсортированный список наборов переменных документа и папку с ними
+        """
+        document = self.document(author, year, doc_item)
+        if doc_item == 'ОНДКП':
+            directory = f"{document.path}/{scenario}"
+        else:
+            scenario = '-'
+            directory = document.path
+        return sorted(document.groups(scenario)), directory
+
+    def group_path(self, author, year, doc_item, scenario, var_group):
+        """
+        Возвращает путь к файлу набора переменных
+        """
+        document = self.document(author, year, doc_item)
+        if doc_item != 'ОНДКП':
+            scenario = '-'
+        return document.groups(scenario).get(var_group)
+
+    def latest_base_forecast(self, author):
+        """
+        Возвращает (год, название, имя папки) последнего базового прогноза автора
+        """
+        year = str(max(map(int, self.years(author))))
+        base_docs = [d for d in self._year(author, year)['docs'].values() if 'Базовый прогноз' in d.item.partition('-')[0]]
+        latest = max(base_docs, key=lambda d: d.order)
+        return year, latest.label, latest.item
+
+
+catalog = Catalog(refresh_interval=int(os.environ.get('CATALOG_REFRESH_SECONDS', 60)))
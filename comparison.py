@@ -0,0 +1,161 @@
+import io
+import logging
+import threading
+
+from answers import document_index, format_fact, year_of
+from cache import file_signature
+from catalog import catalog
+from facts import facts
+from lazy import lazy_import
+from metrics import registry
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+ALL_SCENARIOS = 'Все сценарии'
+BASE_SCENARIO = 'Базовый'
+
+
+def scenario_buttons(author, year):
+    """
+    Сценарии ОНДКП для клавиатуры; если сценариев несколько, в конце - кнопка сравнения всех сразу
+    """
+    scenarios = catalog.scenarios(author, year)
+    if len(scenarios) > 1:
+        scenarios = scenarios + [ALL_SCENARIOS]
+    return scenarios
+
+
+def ordered_scenarios(author, year):
+    """
+    Сценарии ОНДКП: базовый первым, остальные по алфавиту
+    """
+    scenarios = catalog.scenarios(author, year)
+    return sorted(scenarios, key=lambda s: (s != BASE_SCENARIO, s))
+
+
+def scenario_groups(author, year):
+    """
+    Наборы переменных, которые есть хотя бы в одном сценарии ОНДКП
+    """
+    groups = set()
+    for scenario in catalog.scenarios(author, year):
+        groups.update(catalog.var_types(author, year, 'ОНДКП', scenario)[0])
+    return sorted(groups)
+
+
+def scenario_paths(author, year, var_group):
+    """
+    Возвращает {сценарий: путь к файлу набора} для сценариев, в которых набор есть
+    """
+    paths = {}
+    for scenario in ordered_scenarios(author, year):
+        path = catalog.group_path(author, year, 'ОНДКП', scenario, var_group)
+        if path is not None:
+            paths[scenario] = path
+    return paths
+
+
+def _value(v):
+    if pd.isna(v):
+        return '-'
+    return str(v).replace('.', ',')
+
+
+class ScenarioComparison:
+    """
+    Сравнение сценариев ОНДКП по набору переменных: прогнозы выровнены по показателю и году,
+    рядом - факт, если он уже известен. Показатели и годы берутся объединением по всем сценариям.
+    """
+
+    def __init__(self, year, var_group, indexes):
+        self.year = year
+        self.var_group = var_group
+        self.scenarios = list(indexes)
+        self.balance_of_payments = any(index.balance_of_payments for index in indexes.values())
+        self.buttons = []
+        labels = {}
+        for index in indexes.values():
+            self.buttons += [b for b in index.buttons if b not in self.buttons]
+            for col in index.columns:
+                labels.setdefault(year_of(col), col)
+        self.columns = [labels[y] for y in sorted(labels)]
+
+        self.rows = []
+        for button in self.buttons:
+            entries = {s: index.entries[button] for s, index in indexes.items() if button in index.entries}
+            forecasts = {s: {year_of(col): v for col, v in e.forecast.items()} for s, e in entries.items()}
+            facts_ = {}
+            for e in entries.values():
+                for col, r in e.real.items():
+                    if pd.notna(r):
+                        facts_.setdefault(year_of(col), r)
+            name = next(iter(entries.values())).name
+            n = next((e.rounding for e in entries.values() if e.rounding is not None), 1)
+            for y in sorted(labels):
+                values = [_value(forecasts[s].get(y)) if s in forecasts else '-' for s in self.scenarios]
+                real = facts_.get(y)
+                self.rows.append((button, name, labels[y], values, None if real is None else format_fact(real, n)))
+
+    def title(self):
+        return f"Сравнение сценариев ОНДКП-{self.year}, набор \"{self.var_group}\""
+
+    def texts(self):
+        """
+        Текст сравнения: заголовок и по блоку на показатель (строка на год со значениями всех сценариев)
+        """
+        texts = [f"{self.title()}:\n" + ', '.join(self.scenarios)]
+        if self.balance_of_payments:
+            texts[0] += '\n* В РПБ6'
+        lines = []
+        name = None
+        for button, indicator, col, values, real in self.rows:
+            if indicator != name:
+                if lines:
+                    texts.append('\n'.join(lines))
+                name = indicator
+                lines = [f"\"{indicator}\":"]
+            line = f"{col}: " + ' | '.join(f"{s} {v}" for s, v in zip(self.scenarios, values))
+            if real is not None:
+                line += f" (факт: {real})"
+            lines.append(line)
+        if lines:
+            texts.append('\n'.join(lines))
+        return texts
+
+    def xlsx(self):
+        df = pd.DataFrame([[indicator, col] + values + [real if real is not None else '-']
+                           for _, indicator, col, values, real in self.rows],
+                          columns=['Показатель', 'Год'] + self.scenarios + ['Факт'])
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        return buffer.getvalue()
+
+
+_comparisons = {}
+_lock = threading.Lock()
+COMPARISON_REQUESTS = registry.counter('scenario_comparison_requests_total', 'Запросы сравнения сценариев: hit - из памяти, miss - собрано заново', ['result'])
+
+
+def compare_scenarios(author, year, var_group):
+    """
+    Возвращает (ключ для file_id, (подпись, тексты, xlsx)) сравнения сценариев набора.
+    Результат хранится в памяти, пока не изменятся книги сценариев или Факты.xlsx.
+    """
+    paths = scenario_paths(author, year, var_group)
+    key = f"{catalog.document(author, year, 'ОНДКП').path}/{ALL_SCENARIOS}/{var_group}"
+    signature = (tuple((path, file_signature(path)) for path in paths.values()), facts.version())
+    with _lock:
+        cached = _comparisons.get(key)
+        if cached is not None and cached[0] == signature:
+            COMPARISON_REQUESTS.inc(result='hit')
+            return key, cached
+    COMPARISON_REQUESTS.inc(result='miss')
+
+    comparison = ScenarioComparison(year, var_group, {s: document_index(path) for s, path in paths.items()})
+    result = (signature, comparison.texts(), comparison.xlsx())
+    with _lock:
+        _comparisons[key] = result
+    logger.info(f"Scenario comparison built: {key} ({len(paths)} scenarios, {len(comparison.buttons)} indicators)")
+    return key, result
@@ -0,0 +1,305 @@
+import logging
+import os
+import re
+import threading
+import time
+
+from answers import format_fact, normalize_balance_of_payments
+from cache import file_signature, load_sheet
+from catalog import catalog
+from facts import facts
+from lazy import lazy_import
+from vintages import column_year, normalize
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+DIFF_BUTTON = 'Что изменилось'
+DIFF_MAX_LINES = int(os.environ.get('DIFF_MAX_LINES', 300))
+CELL_KEYS = ['group', 'unit', 'key', 'period']
+
+
+def series_of(author, document):
+    """
+    Ряд выпусков, к которому относится документ: с предыдущим выпуском того же ряда он и сравнивается
+    """
+    if author == 'Банк России':
+        if document.item == 'ОНДКП':
+            return 'ОНДКП'
+        if 'Базовый прогноз' in document.item.partition('-')[0]:
+            return 'Базовый прогноз'
+        return 'Краткосрочный прогноз'
+    if author == 'Минфин':
+        return document.label
+    return author
+
+
+class Release:
+    """
+    Выпуск: документ автора за год (для ОНДКП - один сценарий) и его листы
+    [(набор переменных, единицы, путь, лист, платежный баланс)]
+    """
+
+    def __init__(self, author, year, document, scenario, sheets):
+        self.author = author
+        self.year = year
+        self.doc = document.label
+        self.doc_item = document.item
+        self.scenario = scenario
+        self.sheets = sheets
+
+    @property
+    def key(self):
+        return (self.author, self.year, self.doc_item, self.scenario)
+
+    def title(self):
+        title = f"{self.doc}-{self.year}"
+        if self.scenario != '-':
+            title += f" ({self.scenario})"
+        return title
+
+
+def releases():
+    """
+    Все выпуски дерева по рядам, в каждом ряду - в порядке выхода
+    """
+    series = {}
+    for author in catalog.authors():
+        for year in sorted(catalog.years(author), key=int):
+            for document in catalog.documents(author, year):
+                if not document.scenarios:
+                    if author == 'Минфин':
+                        sheets = [('-', unit, document.path, unit, False) for unit in ('трлн руб', '% ВВП')]
+                    else:
+                        sheets = [('-', '', document.path, 0, False)]
+                    series.setdefault((author, series_of(author, document), '-'), []).append(
+                        Release(author, year, document, '-', sheets))
+                    continue
+                for scenario, groups in sorted(document.scenarios.items()):
+                    sheets = [(group, '', path, 0, author == 'Банк России' and group == 'Платежный баланс')
+                              for group, path in sorted(groups.items())]
+                    series.setdefault((author, series_of(author, document), scenario), []).append(
+                        Release(author, year, document, scenario, sheets))
+    return series
+
+
+def parse_numbers(values):
+    """
+    Числа из ячеек (вектором): само число, середина диапазона ('7,0–7,5', '(-6,0)–(-4,0)') или NaN.
+    Пометки вроде '(факт)' отбрасываются.
+    """
+    text = values.astype(str).str.replace(r'[^\d,.\-–—]', '', regex=True).str.replace(',', '.', regex=False)
+    parts = text.str.split(r'[–—]', regex=True, expand=True)
+    numbers = parts.apply(lambda part: pd.to_numeric(part, errors='coerce'))
+    filled = parts.notna() & (parts != '')
+    return numbers.mean(axis=1).where(numbers.notna().sum(axis=1) == filled.sum(axis=1))
+
+
+def _cells(path, sheet_name, group, unit, balance_of_payments):
+    """
+    Ячейки листа длинной таблицей: набор, единицы, показатель, период, текст, число (или NaN) и середина диапазона,
+    а также номера строки и столбца на листе для порядка вывода
+    """
+    df = load_sheet(path, sheet_name=sheet_name)
+    if balance_of_payments:
+        df = normalize_balance_of_payments(df)
+    name_col = df.columns[0]
+    df = df[df[name_col].map(lambda name: isinstance(name, str))].drop_duplicates(subset=name_col)
+    df.insert(0, 'row', range(len(df)))
+    cells = df.melt(id_vars=['row', name_col], var_name='column', value_name='raw').dropna(subset=['raw'])
+    cells = cells.rename(columns={name_col: 'name'})
+    cells['position'] = cells['column'].map({col: i for i, col in enumerate(df.columns[2:])})
+    cells['group'] = group
+    cells['unit'] = unit
+    cells['key'] = cells['name'].map(normalize)
+    cells['period'] = cells['column'].map(lambda col: str(column_year(col) or str(col).strip()))
+    cells['value'] = pd.to_numeric(cells['raw'], errors='coerce')
+    cells['text'] = cells['raw'].astype(str).str.replace('.', ',', regex=False).str.strip()
+    cells['number'] = parse_numbers(cells['raw']).to_numpy()
+    return cells.drop(columns='raw').reset_index(drop=True)
+
+
+def diff_cells(old, new):
+    """
+    Выравнивает два выпуска по набору, показателю и периоду и оставляет только изменившиеся ячейки
+    в порядке листов нового выпуска. Числа сравниваются после округления, как в ответах бота,
+    остальное - по тексту; delta - разница чисел (для диапазонов - их середин).
+    """
+    merged = new.merge(old[CELL_KEYS + ['value', 'text', 'number']], on=CELL_KEYS, suffixes=('', '_old'))
+    if merged.empty:
+        return merged.assign(delta=pd.Series(dtype=float), rounding=pd.Series(dtype=int))
+    rounding = {key: facts.rounding(name, default=1) for key, name in zip(merged['key'], merged['name'])}
+    merged['rounding'] = merged['key'].map(rounding).astype(int)
+    scale = 10.0 ** merged['rounding']
+    rounded = (merged['value'] * scale).round() / scale
+    rounded_old = (merged['value_old'] * scale).round() / scale
+    both = rounded.notna() & rounded_old.notna()
+    changed = np.where(both, rounded != rounded_old,
+                       merged['text'].str.replace(' ', '') != merged['text_old'].str.replace(' ', ''))
+    merged['delta'] = np.where(both, rounded - rounded_old, merged['number'] - merged['number_old'])
+    merged = merged[changed].sort_values(['sheet', 'row', 'position'], kind='stable')
+    return merged.reset_index(drop=True)
+
+
+def _number(value, n):
+    """
+    format_fact без '-0,0': если число округляется до нуля, знак не печатается
+    """
+    return format_fact(round(float(value), n) + 0.0, n)
+
+
+def _shown(value, text, n):
+    return _number(value, n) if pd.notna(value) else text
+
+
+def _precision(value, text, n):
+    """
+    Знаков после запятой в показанном значении: округление показателя для чисел, иначе - как в тексте ячейки
+    """
+    if pd.notna(value):
+        return n
+    return max((len(digits) for digits in re.findall(r'[.,](\d+)', text)), default=0)
+
+
+def _delta(row):
+    """
+    Изменение с точностью показанных значений; разница середин диапазонов может быть на полшага точнее.
+    Пустая строка, если изменение округляется до нуля.
+    """
+    n = max(_precision(row.value_old, row.text_old, row.rounding), _precision(row.value, row.text, row.rounding))
+    delta = float(row.delta)
+    if abs(round(delta, n) - delta) > 1e-9:
+        n += 1
+    delta = round(delta, n) + 0.0
+    if not delta:
+        return ''
+    return f" ({'+' if delta > 0 else ''}{_number(delta, n)})"
+
+
+class ReleaseDiff:
+    """
+    Изменения выпуска относительно предыдущего выпуска того же ряда
+    """
+
+    def __init__(self, release, previous, changes):
+        self.release = release
+        self.previous = previous
+        self.changes = changes
+        self._texts = None
+
+    def texts(self):
+        if self._texts is not None:
+            return self._texts
+        release, previous, changes = self.release, self.previous, self.changes
+        if changes.empty:
+            self._texts = [f"В {release.title()} по сравнению с {previous.title()} значения не изменились"]
+            return self._texts
+        texts = [f"Что изменилось в {release.title()} по сравнению с {previous.title()} (изменено значений: {len(changes)}):"]
+        lines = []
+        shown = 0
+        current = (None, None, None)
+        for row in changes.itertuples(index=False):
+            if shown >= DIFF_MAX_LINES:
+                break
+            if (row.group, row.unit) != current[:2]:
+                if lines:
+                    texts.append('\n'.join(lines))
+                lines = []
+                header = ', '.join(part for part in (row.group if row.group != '-' else '', row.unit) if part)
+                if header:
+                    lines.append(f"{header}:")
+            if (row.group, row.unit, row.key) != current:
+                lines.append(f"\"{row.name}\":")
+                current = (row.group, row.unit, row.key)
+            line = f"{row.column}: {_shown(row.value_old, row.text_old, row.rounding)} -> {_shown(row.value, row.text, row.rounding)}"
+            if pd.notna(row.delta):
+                line += _delta(row)
+            lines.append(line)
+            shown += 1
+        if lines:
+            texts.append('\n'.join(lines))
+        if shown < len(changes):
+            texts.append(f"... и еще изменений: {len(changes) - shown}")
+        self._texts = texts
+        return texts
+
+
+class ReleaseDiffs:
+    """
+    Изменения каждого выпуска относительно предыдущего выпуска того же ряда (базовые прогнозы Банка России,
+    ОНДКП по сценариям, прогнозы МЭР, аналитиков, документы Минфина). Считаются заранее для всех пар
+    соседних выпусков при изменении каталога; заново читаются только изменившиеся листы,
+    а готовый набор подменяется целиком.
+    """
+
+    def __init__(self):
+        self._diffs = {}
+        self._cells = {}
+        self._version = None
+        self._built = False
+        self._lock = threading.Lock()
+
+    def _release_cells(self, cells, release):
+        frames = []
+        for i, (group, unit, path, sheet_name, balance_of_payments) in enumerate(release.sheets):
+            key = (path, sheet_name)
+            signature = file_signature(path)
+            cached = self._cells.get(key)
+            if cached is None or cached[0] != signature:
+                cached = (signature, _cells(path, sheet_name, group, unit, balance_of_payments))
+            cells[key] = cached
+            frames.append(cached[1].assign(sheet=i))
+        return pd.concat(frames, ignore_index=True)
+
+    def _build(self):
+        started = time.monotonic()
+        cells = {}
+        diffs = {}
+        for series in releases().values():
+            previous = None
+            previous_cells = None
+            for release in series:
+                release_cells = self._release_cells(cells, release)
+                if previous is not None:
+                    diffs[release.key] = ReleaseDiff(release, previous, diff_cells(previous_cells, release_cells))
+                previous, previous_cells = release, release_cells
+        self._cells = cells
+        self._diffs = diffs
+        self._built = True
+        logger.info(f"Release diffs built: {len(diffs)} pairs, {sum(len(d.changes) for d in diffs.values())} changed values "
+                    f"in {time.monotonic() - started:.2f} s")
+
+    def ensure_built(self, wait=False):
+        """
+        Пересчитывает изменения, если изменился каталог; пока идет пересчет, отвечает прежняя версия
+        (wait=True - дождаться новой)
+        """
+        version = (catalog.version(), facts.version())
+        if self._version == version:
+            return
+        if not self._lock.acquire(blocking=wait or not self._built):
+            return
+        try:
+            if self._version != version:
+                self._build()
+                self._version = version
+        finally:
+            self._lock.release()
+
+    def get(self, author, year, doc_item, scenario='-'):
+        """
+        ReleaseDiff выпуска или None, если это первый выпуск ряда
+        """
+        self.ensure_built()
+        return self._diffs.get((author, year, doc_item, scenario))
+
+    def texts(self, author, year, doc_item, scenario='-'):
+        diff = self.get(author, year, doc_item, scenario)
+        if diff is None:
+            return None
+        return diff.texts()
+
+
+release_diffs = ReleaseDiffs()
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SELECTION_EDIT_INTERVAL = float(os.environ.get('SELECTION_EDIT_INTERVAL_SECONDS', 1))
+
+
+class SelectionEditor:
+    """
+    Правки сообщения с клавиатурой выбора переменных: не чаще одной за interval секунд на чат.
+    Первая правка уходит сразу, следующие в пределах окна копятся, и отправляется только последняя.
+    При RetryAfter от Telegram правка повторяется после паузы (с самым свежим текстом).
+    """
+
+    def __init__(self, interval=SELECTION_EDIT_INTERVAL, max_retries=3):
+        self.interval = interval
+        self.max_retries = max_retries
+        self._pending = {}
+        self._tasks = {}
+        self._last_sent = {}
+        self.requested = 0
+        self.sent = 0
+        self.saved = 0
+        self.retries = 0
+        self.failed = 0
+
+    def stats_line(self):
+        return f"requested={self.requested}, sent={self.sent}, saved={self.saved}, retries={self.retries}, failed={self.failed}"
+
+    def edit(self, bot, chat_id, message_id, text, reply_markup):
+        key = (chat_id, message_id)
+        self.requested += 1
+        if key in self._pending:
+            self.saved += 1
+        self._pending[key] = (text, reply_markup)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.get_running_loop().create_task(self._run(bot, key))
+
+    def cancel(self, chat_id, message_id):
+        """
+        Отменяет неотправленную правку, например перед удалением сообщения
+        """
+        key = (chat_id, message_id)
+        if self._pending.pop(key, None) is not None:
+            self.saved += 1
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    async def _run(self, bot, key):
+        chat_id = key[0]
+        try:
+            while key in self._pending:
+                wait = self._last_sent.get(chat_id, float('-inf')) + self.interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await self._send(bot, key)
+                self._last_sent[chat_id] = time.monotonic()
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                del self._tasks[key]
+            self._forget_idle_chats()
+
+    async def _send(self, bot, key):
+        chat_id, message_id = key
+        for attempt in range(self.max_retries + 1):
+            entry = self._pending.pop(key, None)
+            if entry is None:
+                return
+            text, reply_markup = entry
+            try:
+                await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, reply_markup=reply_markup)
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                self.retries += 1
+                if key in self._pending:
+                    self.saved += 1
+                else:
+                    self._pending[key] = entry
+                logger.warning(f"Selection edit for chat {chat_id} rate-limited, retry in {e.retry_after} s - {self.stats_line()}")
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                if 'not modified' not in str(e):
+                    self.failed += 1
+                    logger.error(f"Selection edit for chat {chat_id} failed: {e}")
+                return
+            except TelegramError as e:
+                self.failed += 1
+                logger.error(f"Selection edit for chat {chat_id} failed: {e}")
+                return
+        self._pending.pop(key, None)
+        self.failed += 1
+        logger.error(f"Selection edit for chat {chat_id} dropped after {self.max_retries} retries - {self.stats_line()}")
+
+    def _forget_idle_chats(self):
+        now = time.monotonic()
+        for chat_id in [c for c, sent in self._last_sent.items() if now - sent > self.interval]:
+            del self._last_sent[chat_id]
+
+
+selection_edits = SelectionEditor()
+registry.callback('selection_edits_total', 'Правки клавиатуры выбора по исходу', lambda: {
+    'requested': selection_edits.requested, 'sent': selection_edits.sent, 'saved': selection_edits.saved,
+    'retries': selection_edits.retries, 'failed': selection_edits.failed}, 'counter', 'result')
@@ -0,0 +1,150 @@
+import io
+import logging
+import os
+import threading
+
+from answers import normalize_balance_of_payments
+from cache import file_signature, read_excel
+from catalog import catalog
+from facts import facts
+from lazy import lazy_import
+from metrics import registry
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+
+def format_values(values, rounding):
+    """
+    Округляет значения по столбцу 'Округление' и переводит в строки с десятичной запятой.
+    values - двумерный массив (показатель x год), rounding - число знаков для каждой строки.
+    Округление и форматирование выполняются блоками строк с одинаковым числом знаков.
+    Пропуски остаются None.
+    """
+    values = np.asarray(values, dtype=float)
+    rounding = np.asarray(rounding, dtype=float)
+    out = np.full(values.shape, None, dtype=object)
+    for n in np.unique(rounding[~np.isnan(rounding)]):
+        rows = rounding == n
+        block = np.round(values[rows], int(n))
+        present = ~np.isnan(block)
+        if n == 0:
+            text = np.where(present, block, 0).astype(np.int64).astype(str)
+        else:
+            text = block.astype(str)
+        text = np.char.replace(text, '.', ',').astype(object)
+        out[rows] = np.where(present, text, None)
+    return out
+
+
+def annotate_with_facts(df, sheet='Все', fact_years=3):
+    """
+    Добавляет к прогнозу факты: в ячейки прогноза - ' (факт: ...)', слева - столбцы фактов
+    за fact_years лет до первого года прогноза. Прогноз и факты выравниваются одним reindex
+    по показателю и году.
+    """
+    real = facts.frame(sheet)
+    names = df['Показатель']
+    pred_columns = list(df.columns[1:])
+    min_year = int(str(pred_columns[0])[:4])
+    fact_columns = list(range(min_year - fact_years, min_year))
+    years = [int(str(y)[:4]) for y in pred_columns]
+
+    aligned = real.reindex(index=names, columns=fact_columns + years)
+    rounding = real['Округление'].reindex(names).to_numpy(dtype=float)
+    formatted = format_values(aligned.to_numpy(dtype=float), rounding)
+
+    fact_part = formatted[:, :fact_years]
+    fact_part = np.where(pd.isna(fact_part), '-', fact_part)
+
+    pred = np.char.replace(df[pred_columns].astype(object).to_numpy().astype(str), '.', ',').astype(object)
+    real_part = formatted[:, fact_years:]
+    has_fact = pd.notna(real_part)
+    pred = np.where(has_fact, pred + ' (факт: ' + np.where(has_fact, real_part, '').astype(object) + ')', pred)
+
+    out = pd.DataFrame(np.concatenate([fact_part, pred], axis=1),
+                       columns=[f'{y} (факт)' for y in fact_columns] + pred_columns)
+    out.insert(0, 'Показатель', names.to_numpy())
+    return out
+
+
+_exports = {}
+_file_ids = {}
+_lock = threading.Lock()
+EXPORT_REQUESTS = registry.counter('export_requests_total', 'Запросы выгрузки набора: hit - готовый файл, miss - собран заново', ['result'])
+
+
+def export_bytes(path, balance_of_payments=False):
+    """
+    Возвращает xlsx-файл группы переменных с фактами в виде байтов.
+    Готовый файл хранится в памяти, пока не изменятся исходная книга или Факты.xlsx.
+    """
+    signature = (file_signature(path), facts.version())
+    with _lock:
+        cached = _exports.get(path)
+        if cached is not None and cached[0] == signature:
+            EXPORT_REQUESTS.inc(result='hit')
+            return signature, cached[1]
+    EXPORT_REQUESTS.inc(result='miss')
+
+    df = read_excel(path)
+    if balance_of_payments:
+        df = normalize_balance_of_payments(df)
+    df = annotate_with_facts(df)
+    excel_buffer = io.BytesIO()
+    df.to_excel(excel_buffer, index=False)
+    data = excel_buffer.getvalue()
+
+    with _lock:
+        _exports[path] = (signature, data, balance_of_payments)
+    logger.info(f"Export built: {path} ({len(data)} bytes)")
+    return signature, data
+
+
+def export_document(path, exported):
+    """
+    По результату export_bytes возвращает то, что можно передать в reply_document:
+    file_id уже загруженного в Telegram файла или BytesIO с содержимым, и ключ для remember_file_id
+    """
+    signature, data = exported
+    key = (path, signature)
+    file_id = _file_ids.get(key)
+    if file_id is not None:
+        return file_id, key
+    return io.BytesIO(data), key
+
+
+def remember_file_id(key, file_id):
+    with _lock:
+        for old in [k for k in _file_ids if k[0] == key[0]]:
+            del _file_ids[old]
+        _file_ids[key] = file_id
+
+
+def refresh_exports(paths):
+    """
+    Заранее пересобирает уже готовые файлы изменившихся книг и забывает удаленные
+    """
+    for path in paths:
+        with _lock:
+            cached = _exports.get(path)
+        if cached is None:
+            continue
+        if os.path.exists(path):
+            export_bytes(path, balance_of_payments=cached[2])
+        else:
+            with _lock:
+                _exports.pop(path, None)
+
+
+def warm_latest_exports(author='Банк России'):
+    """
+    Заранее собирает файлы всех групп переменных последнего базового прогноза
+    """
+    year, doc, doc_item = catalog.latest_base_forecast(author)
+    var_types, _ = catalog.var_types(author, year, doc_item, '-')
+    for var_group in var_types:
+        export_bytes(catalog.group_path(author, year, doc_item, '-', var_group),
+                     balance_of_payments=author == 'Банк России' and var_group == 'Платежный баланс')
@@ -0,0 +1,123 @@
+import logging
+import threading
+
+from cache import file_signature, load_sheet
+from lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+FACTS_PATH = 'Данные/Факты.xlsx'
+
+
+def column_key(col):
+    """
+    Приводит название столбца к единому виду: годы - к int, кварталы ('3к24') остаются строками
+    """
+    if isinstance(col, str) and col.strip().isdigit():
+        return int(col)
+    try:
+        if float(col) == int(col):
+            return int(col)
+    except (TypeError, ValueError):
+        pass
+    return col
+
+
+class FactsStore:
+    """
+    Фактические значения показателей из Факты.xlsx.
+    Все листы читаются один раз и индексируются по показателю и году (кварталу);
+    при изменении файла данные перечитываются при следующем обращении.
+    """
+
+    def __init__(self, path=FACTS_PATH):
+        self.path = path
+        self.signature = None
+        self._values = {}
+        self._columns = {}
+        self._rounding = {}
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        signature = file_signature(self.path)
+        sheets = load_sheet(self.path, sheet_name=None)
+
+        values = {}
+        columns = {}
+        rounding = {}
+        frames = {}
+        for sheet, df in sheets.items():
+            indicator_col = df.columns[0]
+            frame = df.drop_duplicates(subset=indicator_col).set_index(indicator_col)
+            frame.columns = [column_key(c) for c in frame.columns]
+            frames[sheet] = frame
+            cols = [c for c in df.columns[1:] if c != 'Округление']
+            columns[sheet] = [column_key(c) for c in cols]
+            table = {}
+            for indicator, row in zip(df[indicator_col], df[cols].itertuples(index=False, name=None)):
+                table[indicator] = {column_key(c): v for c, v in zip(cols, row) if pd.notna(v)}
+            values[sheet] = table
+            if 'Округление' in df.columns:
+                for indicator, n in zip(df[indicator_col], df['Округление']):
+                    if pd.notna(n):
+                        rounding.setdefault(indicator, int(n))
+
+        self._values, self._columns, self._rounding, self._frames = values, columns, rounding, frames
+        self.signature = signature
+        logger.info(f"Facts loaded from {self.path}: {', '.join(f'{s} ({len(t)})' for s, t in values.items())}")
+
+    def _ensure_loaded(self):
+        if self.signature != file_signature(self.path):
+            with self._lock:
+                if self.signature != file_signature(self.path):
+                    self.load()
+
+    def version(self):
+        """
+        Возвращает подпись загруженного файла фактов (для проверки производных кэшей)
+        """
+        self._ensure_loaded()
+        return self.signature
+
+    def fact(self, sheet, indicator, year):
+        """
+        Возвращает фактическое значение показателя за год (квартал) или None, если факта нет
+        """
+        self._ensure_loaded()
+        return self._values.get(sheet, {}).get(indicator, {}).get(column_key(year))
+
+    def rounding(self, indicator, default=None):
+        """
+        Возвращает число знаков после запятой для показателя (столбец 'Округление');
+        если показателя нет в фактах и default не задан - KeyError
+        """
+        self._ensure_loaded()
+        if default is not None:
+            return self._rounding.get(indicator, default)
+        return self._rounding[indicator]
+
+    def frame(self, sheet):
+        """
+        Возвращает лист фактов как DataFrame с индексом по показателю (только для чтения)
+        """
+        self._ensure_loaded()
+        return self._frames[sheet]
+
+    def has_column(self, sheet, year):
+        self._ensure_loaded()
+        return column_key(year) in self._columns.get(sheet, [])
+
+    def previous_columns(self, sheet, col, n=3):
+        """
+        Возвращает n столбцов листа, предшествующих столбцу col (для кварталов КСП)
+        """
+        self._ensure_loaded()
+        cols = self._columns[sheet]
+        ind = cols.index(column_key(col))
+        return cols[max(ind - n, 0):ind]
+
+
+facts = FactsStore()
@@ -0,0 +1,120 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+
+from answers import document_index
+from facts import facts
+from keyboards import keyboard_id
+from metrics import registry
+from search import search
+from vintages import normalize, vintages
+
+logger = logging.getLogger(__name__)
+
+INLINE_CACHE_SIZE = int(os.environ.get('INLINE_CACHE_SIZE', 1000))
+INLINE_CACHE_SECONDS = int(os.environ.get('INLINE_CACHE_SECONDS', 300))
+MAX_INDICATORS = 3
+MAX_CARDS = 20
+
+AUTHOR_ALIASES = {
+    'банк россии': 'Банк России', 'цб': 'Банк России', 'цбр': 'Банк России', 'бр': 'Банк России',
+    'мэр': 'МЭР', 'минэк': 'МЭР', 'минэкономразвития': 'МЭР',
+    'минфин': 'Минфин',
+    'аналитики': 'Аналитики', 'консенсус': 'Аналитики',
+}
+_AUTHOR_PATTERN = re.compile(r"(?<!\w)(" + "|".join(sorted(map(re.escape, AUTHOR_ALIASES), key=len, reverse=True)) + r")(?!\w)")
+_YEAR_PATTERN = re.compile(r"(?<!\w)((?:19|20)\d\d)(?!\w)")
+
+
+def parse_query(text):
+    """
+    Разбирает inline-запрос вида "ВВП 2025 ЦБ" в любом порядке слов:
+    возвращает (автор или None, год документа или None, текст для поиска показателя)
+    """
+    text = normalize(text)
+    author = None
+    match = _AUTHOR_PATTERN.search(text)
+    if match:
+        author = AUTHOR_ALIASES[match.group(1)]
+        text = text[:match.start()] + text[match.end():]
+    year = None
+    match = _YEAR_PATTERN.search(text)
+    if match:
+        year = match.group(1)
+        text = text[:match.start()] + text[match.end():]
+    return author, year, ' '.join(text.split())
+
+
+def _button(index, key):
+    for button, name in index.vars_dict.items():
+        if normalize(name) == key:
+            return button
+    return None
+
+
+class InlineAnswers:
+    """
+    Ответы на inline-запросы: готовые карточки с тем же текстом, что бот присылает в диалоге.
+    Результаты кэшируются по нормализованному запросу (LRU на INLINE_CACHE_SIZE запросов)
+    и сбрасываются при изменении каталога или фактов.
+    """
+
+    def __init__(self, size=INLINE_CACHE_SIZE):
+        self.size = size
+        self._cache = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stats_line(self):
+        return f"cached={len(self._cache)}, hits={self.hits}, misses={self.misses}"
+
+    def results(self, text):
+        key = normalize(text)
+        version = (vintages.version(), facts.version())
+        with self._lock:
+            if self._version != version:
+                self._cache.clear()
+                self._version = version
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        results = self._build(key)
+        with self._lock:
+            self._cache[key] = results
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return results
+
+    def _build(self, text):
+        author, year, indicator = parse_query(text)
+        if not indicator:
+            return []
+        results = []
+        for key, shown in search.matches(indicator, MAX_INDICATORS):
+            for location in search.latest(key, author, year):
+                index = document_index(location.path)
+                button = _button(index, key)
+                if button is None:
+                    continue
+                answer = index.render(button, location.doc, location.year, location.scenario)
+                results.append(InlineQueryResultArticle(
+                    id=f"{keyboard_id(location.path)}:{index.buttons.index(button)}",
+                    title=f"{shown} - {location.author}",
+                    description=location.title(),
+                    input_message_content=InputTextMessageContent(answer),
+                ))
+        return results[:MAX_CARDS]
+
+
+inline_answers = InlineAnswers()
+registry.callback('inline_cache_hits_total', 'Inline-запросы из кэша', lambda: inline_answers.hits, 'counter')
+registry.callback('inline_cache_misses_total', 'Inline-запросы, собранные заново', lambda: inline_answers.misses, 'counter')
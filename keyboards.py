@@ -0,0 +1,104 @@
+import os
+import zlib
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from answers import document_index
+
+CALLBACK_PATTERN = r"^(t\d+(\.\d+)?:\d+$|show_selected|clear_selection)"
+
+
+def keyboard_id(path):
+    """
+    Короткий номер набора переменных для callback_data; одинаков между перезапусками
+    """
+    return zlib.crc32(path.encode('utf-8'))
+
+
+def keyboard_version(buttons):
+    """
+    Версия списка переменных: меняется, если в книге переименовали, удалили или переставили переменные
+    """
+    return zlib.crc32('\n'.join(buttons).encode('utf-8')) & 0xffff
+
+
+class SelectionKeyboard:
+    """
+    Заготовка inline-клавиатуры выбора переменных одного набора.
+    Кнопки в обоих вариантах (с ✅ и без) создаются один раз; callback_data кнопки -
+    "t<номер набора>.<версия списка>:<номер переменной>", что укладывается в 64 байта при любой длине названия.
+    """
+
+    def __init__(self, path, buttons):
+        self.id = keyboard_id(path)
+        self.buttons = list(buttons)
+        self.version = keyboard_version(self.buttons)
+        prefix = f"t{self.id}.{self.version}"
+        self._plain = [InlineKeyboardButton(var, callback_data=f"{prefix}:{i}") for i, var in enumerate(self.buttons)]
+        self._checked = [InlineKeyboardButton(f"✅ {var}", callback_data=f"{prefix}:{i}") for i, var in enumerate(self.buttons)]
+        self._footers = {
+            first: (InlineKeyboardButton("📊 Показать прогноз" if first else "📊 Показать выбранные", callback_data="show_selected"),
+                    InlineKeyboardButton("🗑️ Очистить выбор", callback_data="clear_selection"))
+            for first in (True, False)
+        }
+
+    def variable(self, callback_data):
+        """
+        Возвращает (номер, название) переменной по callback_data или None, если кнопка от другого набора
+        или от прежней версии списка переменных
+        """
+        keyboard, _, i = callback_data[1:].partition(':')
+        keyboard, _, version = keyboard.partition('.')
+        i = int(i)
+        if int(keyboard) != self.id or version != str(self.version) or i >= len(self.buttons):
+            return None
+        return i, self.buttons[i]
+
+    def outdated(self, callback_data):
+        """
+        True, если кнопка от этого же набора, но от прежней версии списка переменных
+        """
+        keyboard, _, version = callback_data[1:].partition(':')[0].partition('.')
+        return int(keyboard) == self.id and version != str(self.version)
+
+    def valid(self, selected):
+        """
+        True, если все выбранные переменные есть в текущем списке
+        """
+        return set(selected) <= set(self.buttons)
+
+    def _button(self, i, selected):
+        return self._checked[i] if selected else self._plain[i]
+
+    def markup(self, selected=(), first=False):
+        selected = set(selected)
+        rows = [tuple(self._button(j, var in selected) for j, var in enumerate(self.buttons[i:i+2], i))
+                for i in range(0, len(self.buttons), 2)]
+        return InlineKeyboardMarkup(rows + [self._footers[first]])
+
+
+_keyboards = {}
+
+
+def selection_keyboard(index):
+    """
+    Возвращает заготовку клавиатуры для индекса документа; перестраивает ее вместе с индексом,
+    поэтому номера кнопок всегда соответствуют текущему индексу
+    """
+    cached = _keyboards.get(index.path)
+    if cached is None or cached[0] is not index:
+        cached = _keyboards[index.path] = (index, SelectionKeyboard(index.path, index.buttons))
+    return cached[1]
+
+
+def refresh_keyboards(paths):
+    """
+    Перестраивает заготовки клавиатур изменившихся файлов по их новым индексам и забывает удаленные
+    """
+    for path in paths:
+        if path not in _keyboards:
+            continue
+        if os.path.exists(path):
+            selection_keyboard(document_index(path))
+        else:
+            _keyboards.pop(path, None)
@@ -0,0 +1,50 @@
+import importlib
+import sys
+import threading
+
+_lock = threading.RLock()
+
+
+class LazyModule:
+    """
+    Модуль, который импортируется при первом обращении к его атрибуту.
+    Импорт идет под общей блокировкой, поэтому потоки пула данных не видят модуль недоимпортированным.
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with _lock:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self._name)
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Возвращает модуль, если он уже импортирован, иначе - заглушку, которая импортирует его при первом обращении
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def is_loaded(name):
+    return name in sys.modules
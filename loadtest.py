@@ -0,0 +1,160 @@
+"""
+Нагрузочный тест бота без Telegram.
+
+Поднимает локальный фейковый Bot API, запускает приложение из main.py и параллельно
+проводит N диалогов (по умолчанию - выгрузка последнего базового прогноза).
+Для каждого шага диалога меряет время от отправки обновления до последнего ответа бота
+и печатает p50/p99. Заодно проверяет, что ответы внутри каждого чата пришли по порядку.
+
+Задержка --api-latency имитирует сетевой round-trip до Telegram.
+
+Запуск: python loadtest.py --chats 300 --concurrency 64 --api-latency 100
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+SCENARIO = [
+    ('/start', 1),
+    ('Банк России', 1),
+    ('Последний базовый прогноз', 1),
+    ('Реальный сектор', 2),
+    ('Завершить', 1),
+]
+
+
+class FakeBotAPI:
+    """
+    Минимальный Bot API: отвечает на вызовы бота и складывает отправленные сообщения в очереди по чатам
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.replies = {}
+        self.calls = 0
+        self._message_ids = itertools.count(1)
+        self.app = Starlette(routes=[Route('/bot{token}/{method}', self.api, methods=['GET', 'POST'])])
+
+    def queue(self, chat_id):
+        return self.replies.setdefault(chat_id, asyncio.Queue())
+
+    @staticmethod
+    async def _params(request):
+        body = await request.body()
+        content_type = request.headers.get('content-type', '')
+        if 'json' in content_type:
+            return json.loads(body or b'{}')
+        if 'multipart' in content_type:
+            return dict(re.findall(rb'name="(\w+)"\r\n\r\n([^\r]*)', body))
+        return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+    async def api(self, request: Request) -> JSONResponse:
+        self.calls += 1
+        method = request.path_params['method']
+        params = await self._params(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'bot'}
+        elif method.startswith('send') or method == 'editMessageText':
+            chat_id = int(params.get('chat_id', params.get(b'chat_id', 0)))
+            result = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                      'chat': {'id': chat_id, 'type': 'private'}, 'text': str(params.get('text', ''))}
+            if method == 'sendDocument':
+                result['document'] = {'file_id': 'loadtest', 'file_unique_id': 'loadtest'}
+            self.queue(chat_id).put_nowait((time.monotonic(), method))
+        else:
+            result = True
+        return JSONResponse({'ok': True, 'result': result})
+
+
+def message_update(update_id, chat_id, text):
+    message = {
+        'message_id': update_id, 'date': int(time.time()), 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': f'user{chat_id}'},
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def conversation(application, fake, chat_id, update_ids, latencies, timeout):
+    from telegram import Update
+    replies = fake.queue(chat_id)
+    for text, expected in SCENARIO:
+        sent = time.monotonic()
+        await application.update_queue.put(Update.de_json(message_update(next(update_ids), chat_id, text), application.bot))
+        last = sent
+        for _ in range(expected):
+            received, _ = await asyncio.wait_for(replies.get(), timeout)
+            if received < last:
+                raise AssertionError(f"Chat {chat_id}: replies out of order")
+            last = received
+        latencies.setdefault(text, []).append(last - sent)
+
+
+async def run(args):
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '0:loadtest')
+    os.environ['TELEGRAM_API_URL'] = f'http://127.0.0.1:{args.port}'
+    os.environ['CONCURRENT_UPDATES'] = str(args.concurrency)
+    os.environ.setdefault('STATE_DB', ':memory:')
+    import main
+
+    fake = FakeBotAPI(args.api_latency / 1000)
+    server = uvicorn.Server(uvicorn.Config(fake.app, host='127.0.0.1', port=args.port, log_level='warning'))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    main.facts.load()
+    main.catalog.build()
+    application = main.build_application()
+    latencies = {}
+    update_ids = itertools.count(1)
+    async with application:
+        await application.start()
+        started = time.monotonic()
+        await asyncio.gather(*(conversation(application, fake, 1000 + i, update_ids, latencies, args.timeout)
+                               for i in range(args.chats)))
+        elapsed = time.monotonic() - started
+        await application.stop()
+    server.should_exit = True
+    await server_task
+
+    print(f"{args.chats} conversations, concurrency {args.concurrency}, API latency {args.api_latency:.0f} ms: {elapsed:.2f} s, {fake.calls} Bot API calls")
+    all_latencies = []
+    for text, _ in SCENARIO:
+        values = latencies[text]
+        all_latencies += values
+        print(f"  {text:<28} p50 {percentile(values, 50) * 1000:8.1f} ms   p99 {percentile(values, 99) * 1000:8.1f} ms")
+    print(f"  {'all steps':<28} p50 {percentile(all_latencies, 50) * 1000:8.1f} ms   p99 {percentile(all_latencies, 99) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота на фейковом Bot API')
+    parser.add_argument('--chats', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--api-latency', type=float, default=100, help='задержка ответа Bot API, мс')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(run(args))
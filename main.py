@@ -1,23 +1,38 @@
-from dotenv import load_dotenv
-from background import keep_alive
+import time
+
+started = time.perf_counter()
+
+import asyncio
+import io
 import logging
-from datetime import datetime
-import nest_asyncio
 import os
-import io
-from telegram.ext import CallbackContext, Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
+import threading
+
+import nest_asyncio
 from telegram import Update
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram import BotCommand
-from telegram.ext import CallbackContext, Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler
-import nest_asyncio
-import os
-import pandas as pd
-from dotenv import load_dotenv
-from background import keep_alive
-import logging
-from datetime import datetime
-from collections import OrderedDict
+from telegram.ext import CallbackContext, Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler, TypeHandler, InlineQueryHandler
+from facts import facts
+from catalog import catalog
+from export import export_bytes, export_document, remember_file_id, warm_latest_exports
+from answers import document_index, warm_latest_base_forecast
+from keyboards import CALLBACK_PATTERN, keyboard_id, selection_keyboard
+from edits import selection_edits
+from outbox import outbox
+from vintages import vintages, normalize, series_text, series_export
+from accuracy import accuracy, indicator_text, summary_text, stats_export
+from comparison import ALL_SCENARIOS, compare_scenarios, scenario_buttons, scenario_groups, scenario_paths
+from diffs import DIFF_BUTTON, release_diffs
+from search import search
+from inline import inline_answers, INLINE_CACHE_SECONDS
+from watcher import watcher
+from metrics import InstrumentedRequest, instrument, monitor_event_loop, startup
+from workers import run_data
+from updates import PerChatUpdateProcessor
+from persistence import SQLitePersistence, STATE_DB, SESSION_TTL, evict_idle
+
+startup.phase('imports', since=started)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -25,11 +40,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-keep_alive()
-
 nest_asyncio.apply()
+logging.getLogger('apscheduler').setLevel(logging.WARNING)
 
 bot_token = os.environ['TELEGRAM_BOT_TOKEN']
+telegram_api_url = os.environ.get('TELEGRAM_API_URL')
+webhook_url = os.environ.get('WEBHOOK_URL')
+webhook_port = int(os.environ.get('PORT', 80))
+webhook_secret = os.environ.get('WEBHOOK_SECRET')
+concurrent_updates = int(os.environ.get('CONCURRENT_UPDATES', 64))
 
 AUTHOR, DOC_YEAR, DOC, SCENARIO, VAR_GROUP, VAR, PRED = range(7)
 
@@ -47,148 +66,14 @@ def log_user_action(update, action, context):
     
     logger.info(message)
 
-def get_unique_authors(directory):
-    """
-    Возвращает список уникальных авторов - названий папок в директории
-    """
-    unique_authors = set()
-    
-    if not os.path.exists(directory):
-        raise FileNotFoundError(f"Директория '{directory}' не существует")
-    
-    for item in os.listdir(directory):
-        full_path = os.path.join(directory, item)
-        if os.path.isdir(full_path):
-            unique_authors.add(item)
-    
-    unique_authors = sorted(unique_authors)
-    
-    return unique_authors
-
-def get_unique_doc_years(author):
-    """
-    Возвращает список уникальных годов - названий папок для прогнозов выбранного автора
-    """
-    unique_years = set()
-    directory = f"Данные/{author}"
-    
-    if not os.path.exists(directory):
-        raise FileNotFoundError(f"Директория '{directory}' не существует")
-    
-    for item in os.listdir(directory):
-        full_path = os.path.join(directory, item)
-        if os.path.isdir(full_path):
-            unique_years.add(item)
-    
-    unique_years = list(map(str, sorted(map(int, unique_years), reverse=True)))
-    
-    return unique_years
-
-def get_doc_types_keyboard(author, year):
-    """
-    Возвращает список уникальных названий документов для конкретного года
-    """
-    num = 0
-    directory = f"Данные/{author}/{year}"
-
-    if not os.path.exists(directory):
-        raise FileNotFoundError(f"Директория '{directory}' не существует")
-
-    keyboard_doc_types = []
-    if author == "Банк России":
-        for item in os.listdir(directory):
-            full_path = os.path.join(directory, item)
-            if os.path.isdir(full_path):
-                if item == 'ОНДКП':
-                    keyboard_doc_types = keyboard_doc_types + [[item]]
-
-        b_doc_types = []
-        for item in os.listdir(directory):
-            full_path = os.path.join(directory, item)
-            if os.path.isdir(full_path):
-                if 'Базовый прогноз' in item.partition('-')[0]:
-                    b_doc_types.append((item.split('-')[0] + '-' + item.split('-')[2].split('.')[0], int(item.split('-')[1]) - 1))
-        b_doc_types = list(map(lambda x: x[0], sorted(b_doc_types, key=lambda x: x[1])))
-        b_doc_types = [b_doc_types[i:i+2] for i in range(0, len(b_doc_types), 2)]
-        keyboard_doc_types = keyboard_doc_types + b_doc_types
-
-        k_doc_types = []
-        for item in os.listdir(directory):
-            if item.partition('-')[0] == 'Краткосрочный прогноз':
-                k_doc_types.append((item.split('-')[0] + '-' + item.split('-')[2].split('.')[0], int(item.split('-')[1]) - 1))
-        k_doc_types = list(map(lambda x: x[0], sorted(k_doc_types, key=lambda x: x[1])))
-        k_doc_types = [k_doc_types[i:i+2] for i in range(0, len(k_doc_types), 2)]
-    
-        keyboard_doc_types = keyboard_doc_types + k_doc_types
-
-    elif author == "Минфин":
-        for item in os.listdir(directory):
-            keyboard_doc_types = keyboard_doc_types + [[item.split('.')[0]]]
-
-    elif author == "МЭР":
-        doc_types = []
-        for item in os.listdir(directory):
-            doc_types = doc_types + [item.split('.')[0]]
-            doc_types = sorted(doc_types)
-        for doci in doc_types:
-            keyboard_doc_types = keyboard_doc_types + [[doci]]
-
-    elif author == "Аналитики":
-        months = []
-        month_order = ['Янв', 'Фев', 'Мар', 'Апр', 'Май', 'Июн', 
-               'Июл', 'Авг', 'Сен', 'Окт', 'Ноя', 'Дек']
-        for item in os.listdir(directory):
-            months = months + [item]
-
-        months = sorted(months, key=lambda x: month_order.index(x))
-        keyboard_doc_types = [months[i:i+4] for i in range(0, len(months), 4)]
-    
-    return keyboard_doc_types
-
-def get_unique_scenarios(author, year):
-    unique_scenarios = set()
-    directory = f"Данные/{author}/{year}/ОНДКП"
-    for item in os.listdir(directory):
-        full_path = os.path.join(directory, item)
-        if os.path.isdir(full_path):
-            unique_scenarios.add(item)
-    return list(unique_scenarios)
-
-def get_var_type(author, year, doc_item, scenario):
-    var_types = set()
-    if doc_item == 'ОНДКП':
-        directory = f"Данные/{author}/{year}/{doc_item}/{scenario}"
-    elif ('Базовый прогноз' in doc_item.split('-')[0]) or (doc_item in month_order) or ('прогноз МЭР' in doc_item):
-        directory = f"Данные/{author}/{year}/{doc_item}"
-    for item in os.listdir(directory):
-        var_types.add(item.split('.')[0])
-    return sorted(list(var_types)), directory
-
-def vars_dict_from_list(vars_list):
-    vars_dict = result_dict = OrderedDict((item, item) for item in vars_list)
-    replacements = [('Баланс первичных и вторичных доходов', 'Первичные и вторичные доходы'), 
-                    ('Финансовый счет (искл. резервы)', 'Финансовый счет'), 
-                    ('Финансовый счет (включая резервы)', 'Финансовый счет'),
-                    ('Сальдо ФС по частному сектору (вкл. ошибки)', 'Сальдо ФС по частному сектору'),
-                    ('Сальдо фин. операций частного сектора', 'Сальдо фин. операций частн. сектора'),
-                    ('Чистое приобретение активов, искл. резервы', 'Чистое приобретение активов'),
-                    ('Экспортная цена на российскую нефть', 'Цена на российскую нефть'),
-                    ('Баланс консолидированного бюджета', 'Консолидированный бюджет'),
-                    ('Среднегодовой уровень безработицы', 'Уровень безработицы'),
-                    ('Ставка, ФРС США, верхняя граница диапазона, %, в среднем за год', 'Ставка, ФРС США, среднегодовая'),
-                    ('Ставка, ЕЦБ депозитная, %, в среднем за год', 'Ставка, ЕЦБ, среднегодовая'),
-                    ('Базовые нефтегазовые доходы', 'Баз. нефтегаз. доходы'),
-                    ('Дополнительные нефтегазовые доходы', 'Доп. нефтегаз. доходы')
-                   ]
-    for old, new in replacements:
-        if old in vars_dict:
-            vars_dict[new] = result_dict.pop(old)
-    return result_dict
-
 async def start(update, context):
     log_user_action(update, "Start command", context)
     context.user_data.clear()
-    authors = get_unique_authors('Данные')
+    if context.args and context.args[0][:1] == 'g' and context.args[0][1:].isdigit():
+        location = await run_data(search.location, int(context.args[0][1:]))
+        if location is not None:
+            return await open_location(update, context, location)
+    authors = catalog.authors()
     keyboard = [authors[i:i+2] for i in range(0, len(authors), 2)]
     reply_markup_year = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
@@ -201,7 +86,7 @@ async def start(update, context):
 
 async def author_received(update, context):
     log_user_action(update, "Year selected", context)
-    authors = get_unique_authors('Данные')
+    authors = catalog.authors()
     if update.message.text not in authors and update.message.text!='↩️Возврат к выбору года':
         keyboard = [authors[i:i+2] for i in range(0, len(authors), 2)]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -215,7 +100,7 @@ async def author_received(update, context):
         author = update.message.text
         context.user_data['author'] = author
 
-    years = get_unique_doc_years(context.user_data['author'])
+    years = catalog.years(context.user_data['author'])
     keyboard = []
     if context.user_data['author'] == "Банк России":
         keyboard = [['Последний базовый прогноз']]
@@ -236,7 +121,7 @@ async def year_received(update, context):
         return await start(update, context)
 
     context.user_data['var'] = '-'
-    years = get_unique_doc_years(context.user_data['author'])
+    years = catalog.years(context.user_data['author'])
     if update.message.text not in years and update.message.text!='↩️Возврат к выбору документа':
         if (update.message.text=='Последний базовый прогноз') and (context.user_data['author'] == 'Банк России'):
             pass
@@ -257,25 +142,14 @@ async def year_received(update, context):
         context.user_data['year'] = year
 
     elif update.message.text == 'Последний базовый прогноз':
-        max_year = str(max(map(int, get_unique_doc_years(context.user_data['author']))))
-        imax = 0
-        docmax =''
-        context.user_data['year'] = max_year
-        directory_year = f"Данные/{context.user_data['author']}/{context.user_data['year']}"
-        for item in os.listdir(directory_year):
-            full_path = os.path.join(directory_year, item)
-            if os.path.isdir(full_path):
-                if 'Базовый прогноз' in item.partition('-')[0]:
-                    if int(item.partition('-')[2].partition('-')[0]) > imax:
-                        imax = int(item.partition('-')[2].partition('-')[0])
-                        docmax = item.partition('-')[0] + '-' + item.partition('-')[2].partition('-')[2]
-                        doc_item_max = item
-        context.user_data['doc'] = docmax
-        context.user_data['doc_item'] = doc_item_max
+        year, doc, doc_item = catalog.latest_base_forecast(context.user_data['author'])
+        context.user_data['year'] = year
+        context.user_data['doc'] = doc
+        context.user_data['doc_item'] = doc_item
         context.user_data['var'] = 'all'
         return await doc_type_received(update, context)
 
-    keyboard = get_doc_types_keyboard(context.user_data['author'], context.user_data['year']) + [['↩️Возврат к выбору года']]
+    keyboard = catalog.doc_keyboard(context.user_data['author'], context.user_data['year']) + [['↩️Возврат к выбору года']]
     reply_markup_doc_type = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
     if (context.user_data['author'] == "Банк России") or (context.user_data['author'] == "Минфин") or (context.user_data['author'] == "МЭР"):
@@ -293,7 +167,7 @@ async def doc_type_received(update, context):
     if update.message.text == '↩️Возврат к выбору года':
         return await author_received(update, context)
     
-    keyboard = get_doc_types_keyboard(context.user_data['author'], context.user_data['year'])
+    keyboard = catalog.doc_keyboard(context.user_data['author'], context.user_data['year'])
     docs = sum(keyboard, [])
     keyboard = keyboard + [['↩️Возврат к выбору года']]
     if (update.message.text not in docs) and (update.message.text != 'Последний базовый прогноз'):
@@ -313,10 +187,9 @@ async def doc_type_received(update, context):
         doc_type = update.message.text
         context.user_data['doc'] = doc_type
     
-    directory = f"Данные/{context.user_data['author']}/{context.user_data['year']}"
     if context.user_data['doc'] == 'ОНДКП':
         context.user_data['doc_item'] = context.user_data['doc']
-        buttons = sorted(get_unique_scenarios(context.user_data['author'], context.user_data['year']))
+        buttons = scenario_buttons(context.user_data['author'], context.user_data['year'])
         keyboard = [buttons[i:i+2] for i in range(0, len(buttons), 2)] + [['↩️Возврат к выбору документа']]
         reply_markup_doc_type = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
@@ -327,31 +200,20 @@ async def doc_type_received(update, context):
         return SCENARIO
 
     elif ('Базовый прогноз' in context.user_data['doc'].split('-')[0]):
-        for item in os.listdir(directory):
-            full_path = os.path.join(directory, item)
-            if os.path.isdir(full_path):
-                if item.split('-')[0] == context.user_data['doc'].split('-')[0] and item.split('-')[2] == context.user_data['doc'].split('-')[1]:
-                    if update.message.text != 'Последний базовый прогноз':
-                        context.user_data['doc_item'] = item
+        if update.message.text != 'Последний базовый прогноз':
+            context.user_data['doc_item'] = catalog.doc_item(context.user_data['author'], context.user_data['year'], context.user_data['doc'])
         return await scenario_received(update, context)
 
     elif (context.user_data['doc'] in month_order) or ('прогноз МЭР' in context.user_data['doc']):
-        for item in os.listdir(directory):
-            context.user_data['doc_item'] = context.user_data['doc']
+        context.user_data['doc_item'] = context.user_data['doc']
         return await scenario_received(update, context)
 
     elif context.user_data['doc'].split('.')[0] in ['Бюджетная система (ОНБП)', 'Федеральный бюджет (ФЗоФБ)']:
-        for item in os.listdir(directory):
-            full_path = os.path.join(directory, item)
-            if item.split('.')[0] == context.user_data['doc'].split('.')[0]:
-                context.user_data['doc_item'] = item
+        context.user_data['doc_item'] = catalog.doc_item(context.user_data['author'], context.user_data['year'], context.user_data['doc'].split('.')[0])
         return await scenario_received(update, context)
     
     elif context.user_data['doc'].split('-')[0] == 'Краткосрочный прогноз':
-        for item in os.listdir(directory):
-            full_path = os.path.join(directory, item)
-            if item.split('-')[0] == context.user_data['doc'].split('-')[0] and item.split('-')[2].split('.')[0] == context.user_data['doc'].split('-')[1]:
-                context.user_data['doc_item'] = item
+        context.user_data['doc_item'] = catalog.doc_item(context.user_data['author'], context.user_data['year'], context.user_data['doc'])
         return await scenario_received(update, context)
 
 
@@ -360,7 +222,7 @@ async def scenario_received(update, context):
     if update.message.text == '↩️Возврат к выбору документа':
         return await year_received(update, context)
     if context.user_data['doc'] == 'ОНДКП':
-        scenarios = sorted(get_unique_scenarios(context.user_data['author'], context.user_data['year']))
+        scenarios = scenario_buttons(context.user_data['author'], context.user_data['year'])
         if update.message.text not in scenarios  and update.message.text != 'Выбрать другой набор переменных' and update.message.text != '↩️Возврат к выбору набора переменных':
             keyboard = [scenarios[i:i+2] for i in range(0, len(scenarios), 2)] + [['↩️Возврат к выбору документа']]
             reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -374,29 +236,32 @@ async def scenario_received(update, context):
             scenario = update.message.text
             context.user_data['scenario'] = scenario
         
-        var_types, path = get_var_type(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'])
-        context.user_data['path_folders'] = path
+        if context.user_data['scenario'] == ALL_SCENARIOS:
+            var_types = scenario_groups(context.user_data['author'], context.user_data['year'])
+            text = f"Вы выбрали сравнение всех сценариев {context.user_data['doc']}-{context.user_data['year']}. Переменные из какого набора Вас интересуют?"
+        else:
+            var_types, path = catalog.var_types(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'])
+            context.user_data['path_folders'] = path
+            text = f"Вы выбрали сценарий \"{context.user_data['scenario']}\" из {context.user_data['doc']}-{context.user_data['year']}. Переменные из какого набора Вас интересуют?"
 
         var_types = sorted(var_types, reverse=True)
-        keyboard = [[type] for type in var_types] + [['↩️Возврат к выбору сценария']]
+        keyboard = [[type] for type in var_types] + ([[DIFF_BUTTON]] if context.user_data['scenario'] != ALL_SCENARIOS else []) + [['↩️Возврат к выбору сценария']]
         reply_markup_year = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        await update.message.reply_text(
-            f"Вы выбрали сценарий \"{context.user_data['scenario']}\" из {context.user_data['doc']}-{context.user_data['year']}. Переменные из какого набора Вас интересуют?", 
-            reply_markup = reply_markup_year)
+        await update.message.reply_text(text, reply_markup = reply_markup_year)
         
         return VAR_GROUP
 
     
     elif ('Базовый прогноз' in context.user_data['doc'].split('-')[0]) or (context.user_data['doc'] in month_order) or ('прогноз МЭР' in context.user_data['doc']):
         context.user_data['scenario'] = '-'
-        var_types, path = get_var_type(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'])
+        var_types, path = catalog.var_types(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'])
         context.user_data['path_folders'] = path
 
         var_types = sorted(var_types, reverse=True)
         if context.user_data['var'] == 'all':
-            keyboard = [[type] for type in var_types] + [['↩️Возврат к выбору года']]
+            keyboard = [[type] for type in var_types] + [[DIFF_BUTTON], ['↩️Возврат к выбору года']]
         else:
-            keyboard = [[type] for type in var_types] + [['↩️Возврат к выбору документа']]
+            keyboard = [[type] for type in var_types] + [[DIFF_BUTTON], ['↩️Возврат к выбору документа']]
         reply_markup_year = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         await update.message.reply_text(
             f"Вы выбрали {context.user_data['doc']}-{context.user_data['year']}. Переменные из какого набора Вас интересуют?", 
@@ -413,6 +278,8 @@ async def scenario_received(update, context):
 
 async def var_group_received(update, context):
     log_user_action(update, "Var_group selected", context)
+    if update.message.text == DIFF_BUTTON:
+        return await send_release_diff(update, context, VAR_GROUP)
     if context.user_data['doc'] == 'ОНДКП':
         if update.message.text == '↩️Возврат к выбору сценария':
             return await doc_type_received(update, context)
@@ -422,10 +289,13 @@ async def var_group_received(update, context):
         return await author_received(update, context)
         
     if context.user_data['doc'] == 'ОНДКП':
-        var_types, path = get_var_type(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'])
+        if context.user_data['scenario'] == ALL_SCENARIOS:
+            var_types = scenario_groups(context.user_data['author'], context.user_data['year'])
+        else:
+            var_types, path = catalog.var_types(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'])
         if update.message.text not in var_types and update.message.text != 'Выбрать другую переменную':
             var_types = sorted(var_types, reverse=True)
-            keyboard = [[type] for type in var_types] + [['↩️Возврат к выбору сценария']]
+            keyboard = [[type] for type in var_types] + ([[DIFF_BUTTON]] if context.user_data['scenario'] != ALL_SCENARIOS else []) + [['↩️Возврат к выбору сценария']]
             reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
             await update.message.reply_text(
             "Пожалуйста, выберите группу переменных из предложенных вариантов:",
@@ -434,13 +304,13 @@ async def var_group_received(update, context):
             return VAR_GROUP
     
     elif ('Базовый прогноз' in context.user_data['doc'].split('-')[0]) or (context.user_data['doc'] in month_order) or ('прогноз МЭР' in context.user_data['doc']):
-        var_types, path = get_var_type(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'])
+        var_types, path = catalog.var_types(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'])
         if update.message.text not in var_types and update.message.text != 'Выбрать другую переменную':
             var_types = sorted(var_types, reverse=True)
             if context.user_data['var'] == 'all':
-                keyboard = [[type] for type in var_types] + [['↩️Возврат к выбору года']]
+                keyboard = [[type] for type in var_types] + [[DIFF_BUTTON], ['↩️Возврат к выбору года']]
             else:
-                keyboard = [[type] for type in var_types] + [['↩️Возврат к выбору документа']]
+                keyboard = [[type] for type in var_types] + [[DIFF_BUTTON], ['↩️Возврат к выбору документа']]
             reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
             await update.message.reply_text(
             "Пожалуйста, выберите группу переменных из предложенных вариантов:",
@@ -452,46 +322,69 @@ async def var_group_received(update, context):
         if update.message.text != 'Выбрать другую переменную':
             var_group = update.message.text
             context.user_data['var_group'] = var_group
+
+        if context.user_data['scenario'] == ALL_SCENARIOS:
+            return await send_scenario_comparison(update, context)
         
-        for item in os.listdir(context.user_data['path_folders']):
-            if item.split('.')[0] == context.user_data['var_group']:
-                context.user_data['path'] = context.user_data['path_folders'] + '/' + item
+        context.user_data['path'] = catalog.group_path(context.user_data['author'], context.user_data['year'], context.user_data['doc_item'], context.user_data['scenario'], context.user_data['var_group'])
     
     elif (context.user_data['doc'].split('-')[0] == 'Краткосрочный прогноз') or (context.user_data['doc'].split('.')[0] in ['Бюджетная система (ОНБП)', 'Федеральный бюджет (ФЗоФБ)']):
         context.user_data['var_group'] = '-'
         context.user_data['path'] = context.user_data['path_folders']
     
-    df = pd.read_excel(context.user_data['path'])
-    vars_list = list(df.iloc[:, 0])
-    vars_dict = vars_dict_from_list(vars_list)
-    vars_button_name = list(vars_dict.keys())
-    
     if context.user_data['var'] == 'all':
         return await vars_received(update, context)
 
+    return await show_var_selection(update, context)
+
+async def send_release_diff(update, context, state):
+    """
+    Что изменилось в выбранном документе по сравнению с предыдущим выпуском того же ряда (посчитано заранее)
+    """
+    texts = await run_data(release_diffs.texts, context.user_data['author'], context.user_data['year'],
+                           context.user_data['doc_item'], context.user_data['scenario'])
+    if texts is None:
+        texts = [f"{context.user_data['doc']}-{context.user_data['year']} - первый выпуск этого ряда в боте, сравнивать не с чем"]
+    await outbox.send_many(context.bot, update.effective_chat.id, texts)
+    return state
+
+async def send_scenario_comparison(update, context):
+    """
+    Сравнение всех сценариев ОНДКП по выбранному набору: книги сценариев читаются параллельно,
+    готовое сравнение (текст и xlsx) берется из кэша
+    """
+    author, year, var_group = context.user_data['author'], context.user_data['year'], context.user_data['var_group']
+    paths = scenario_paths(author, year, var_group)
+    await asyncio.gather(*(run_data(document_index, path) for path in paths.values()))
+    key, (signature, texts, data) = await run_data(compare_scenarios, author, year, var_group)
+
+    keyboard = [['Выбрать другой набор переменных'], ['Заново'], ['Завершить']]
+    reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    await outbox.send_many(context.bot, update.effective_chat.id, texts)
+    document, file_key = export_document(key, (signature, data))
+    message = await update.message.reply_document(
+        document = document,
+        filename = f'{var_group}-{context.user_data['doc']}-{year}-сценарии.xlsx',
+        caption = f'Сравнение сценариев набора {var_group} из {context.user_data['doc']}-{year} в одной таблице',
+        reply_markup = reply_markup
+    )
+    if message.document is not None:
+        remember_file_id(file_key, message.document.file_id)
+    return PRED
+
+async def show_var_selection(update, context):
+    index = await run_data(document_index, context.user_data['path'])
+
     if 'selected_vars' not in context.user_data:
         context.user_data['selected_vars'] = []
 
-    keyboard = []
-    for i in range(0, len(vars_button_name), 2):
-        row = []
-        for var in vars_button_name[i:i+2]:
-            is_selected = var in context.user_data['selected_vars']
-            callback_data = f"toggle_{var}"
-            text = f"✅ {var}" if is_selected else var
-            row.append(InlineKeyboardButton(text, callback_data=callback_data))
-        keyboard.append(row)
-    keyboard.append([
-        InlineKeyboardButton("📊 Показать прогноз", callback_data="show_selected"),
-        InlineKeyboardButton("🗑️ Очистить выбор", callback_data="clear_selection")
-    ])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = selection_keyboard(index).markup(context.user_data['selected_vars'], first=True)
 
     nav_keyboard = []
     if (context.user_data['doc'] == 'ОНДКП') or ('Базовый прогноз' in context.user_data['doc'].split('-')[0]) or (context.user_data['doc'] in month_order) or ('прогноз МЭР' in context.user_data['doc']):
         nav_keyboard = [['↩️Возврат к выбору набора переменных']]
     elif (context.user_data['doc'].split('-')[0] == 'Краткосрочный прогноз') or (context.user_data['doc'].split('.')[0] in ['Бюджетная система (ОНБП)', 'Федеральный бюджет (ФЗоФБ)']):
-        nav_keyboard = [['↩️Возврат к выбору документа']]
+        nav_keyboard = [[DIFF_BUTTON], ['↩️Возврат к выбору документа']]
     
     nav_reply_markup = ReplyKeyboardMarkup(nav_keyboard, resize_keyboard=True)
     
@@ -531,42 +424,62 @@ async def var_group_received(update, context):
         
     return VAR
 
+async def open_location(update, context, location):
+    """
+    Переход по ссылке из /find сразу к выбору переменных в наборе, как если бы его выбрали по шагам
+    """
+    context.user_data.update({
+        'author': location.author, 'year': location.year, 'doc': location.doc, 'doc_item': location.doc_item,
+        'scenario': location.scenario, 'var_group': location.group, 'var': '-', 'path': location.path,
+    })
+    if location.group == '-':
+        context.user_data['path_folders'] = location.path
+    return await show_var_selection(update, context)
+
+async def current_keyboard(context):
+    """
+    Клавиатура выбора для текущего индекса документа (индекс из памяти, если файл не менялся)
+    """
+    return selection_keyboard(await run_data(document_index, context.user_data['path']))
+
+def refresh_selection(query, context, keyboard):
+    """
+    Документ изменился во время выбора: сбрасывает выбор, если выбранных переменных больше нет в списке,
+    и показывает в сообщении актуальную клавиатуру
+    """
+    if not keyboard.valid(context.user_data['selected_vars']):
+        context.user_data['selected_vars'] = []
+    selected = context.user_data['selected_vars']
+    text = "Выберите переменные:" + (f"\n\nВыбрано переменных: {len(selected)}" if selected else "")
+    selection_edits.edit(context.bot, query.message.chat_id, query.message.message_id, text=text, reply_markup=keyboard.markup(selected))
+
 async def handle_inline_selection(update, context):
     query = update.callback_query
-    await query.answer()
-    
     callback_data = query.data
     
-    if callback_data.startswith("toggle_"):
-        var_name = callback_data[7:]
-        if var_name in context.user_data['selected_vars']:
-            context.user_data['selected_vars'].remove(var_name)
-        else:
+    if callback_data.startswith("t"):
+        keyboard = await current_keyboard(context)
+        variable = keyboard.variable(callback_data)
+        if variable is None:
+            await query.answer("Этот список переменных устарел", show_alert=True)
+            if keyboard.outdated(callback_data):
+                refresh_selection(query, context, keyboard)
+            return
+        await query.answer()
+        if not keyboard.valid(context.user_data['selected_vars']):
+            context.user_data['selected_vars'] = []
+        _, var_name = variable
+        is_selected = var_name not in context.user_data['selected_vars']
+        if is_selected:
             context.user_data['selected_vars'].append(var_name)
-        
-        df = pd.read_excel(context.user_data['path'])
-        vars_list = list(df.iloc[:, 0])
-        vars_dict = vars_dict_from_list(vars_list)
-        vars_button_name = list(vars_dict.keys())
-        
-        keyboard = []
-        for i in range(0, len(vars_button_name), 2):
-            row = []
-            for var in vars_button_name[i:i+2]:
-                is_selected = var in context.user_data['selected_vars']
-                callback_data = f"toggle_{var}"
-                text = f"✅ {var}" if is_selected else var
-                row.append(InlineKeyboardButton(text, callback_data=callback_data))
-            keyboard.append(row)
-        
-        keyboard.append([
-            InlineKeyboardButton("📊 Показать выбранные", callback_data="show_selected"),
-            InlineKeyboardButton("🗑️ Очистить выбор", callback_data="clear_selection")
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        else:
+            context.user_data['selected_vars'].remove(var_name)
+
+        chat_id, message_id = query.message.chat_id, query.message.message_id
+        reply_markup = keyboard.markup(context.user_data['selected_vars'])
         selected_count = len(context.user_data['selected_vars'])
-        await query.edit_message_text(
+        selection_edits.edit(
+            context.bot, chat_id, message_id,
             text=f"Выберите переменные:\n\nВыбрано переменных: {selected_count}",
             reply_markup=reply_markup
         )
@@ -575,258 +488,34 @@ async def handle_inline_selection(update, context):
             if not context.user_data['selected_vars']:
                 await query.answer("Вы не выбрали ни одной переменной", show_alert=True)
                 return
+            keyboard = await current_keyboard(context)
+            if not keyboard.valid(context.user_data['selected_vars']):
+                await query.answer("Список переменных обновился, выберите переменные заново", show_alert=True)
+                refresh_selection(query, context, keyboard)
+                return
+            await query.answer()
             await show_selected_vars(update, context)
             return PRED
     
     elif callback_data == "clear_selection":
         context.user_data['selected_vars'] = []
-        df = pd.read_excel(context.user_data['path'])
-        vars_list = list(df.iloc[:, 0])
-        vars_dict = vars_dict_from_list(vars_list)
-        vars_button_name = list(vars_dict.keys())
-        
-        keyboard = []
-        for i in range(0, len(vars_button_name), 2):
-            row = []
-            for var in vars_button_name[i:i+2]:
-                callback_data = f"toggle_{var}"
-                row.append(InlineKeyboardButton(var, callback_data=callback_data))
-            keyboard.append(row)
-        
-        keyboard.append([
-            InlineKeyboardButton("📊 Показать выбранные", callback_data="show_selected"),
-            InlineKeyboardButton("🗑️ Очистить выбор", callback_data="clear_selection")
-        ])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await query.edit_message_text(text="Выберите переменные:", reply_markup=reply_markup)
+        keyboard = await current_keyboard(context)
+        selection_edits.edit(context.bot, query.message.chat_id, query.message.message_id, text="Выберите переменные:", reply_markup=keyboard.markup())
         await query.answer("Выбор очищен")
 
 async def show_selected_vars(update, context):
     query = update.callback_query
     
-    df = pd.read_excel(context.user_data['path'])
-    vars_list = list(df.iloc[:, 0])
-    vars_dict = vars_dict_from_list(vars_list)
-    pred_years = list(df.columns)[1:]
+    index = await run_data(document_index, context.user_data['path'])
     all_messages = []
 
-    if (context.user_data['author'].split('-')[0] == "Банк России") and (context.user_data['var_group'] == "Платежный баланс"):
-        list_var_rpb = ['Импорт товаров', 'Импорт услуг', 'Импорт товаров и услуг', 
-                        'Финансовый счет (искл. резервы)', 'Сальдо ФС по госсектору', 
-                        'Сальдо ФС по частному сектору (вкл. ошибки)', 'Сальдо ФС по частному сектору']
-        list_var_change = []
-        was_rpb5 = 0
-        for vpb in df['Показатель']:
-            if vpb in list_var_rpb:
-                list_var_change.append(vpb)
-            if 'Импорт' in vpb:
-                vpb_im = vpb
-        
-        for y in pred_years:
-            if df.loc[df['Показатель'] == vpb_im, y].iloc[0] < 0:
-                was_rpb5 = 1
-                mask = df['Показатель'].isin(list_var_change)
-                df.loc[mask, y] = df.loc[mask, y] * (-1)
-    
     for var in context.user_data['selected_vars']:
-        if context.user_data['doc'] == 'ОНДКП':
-            text = [f"Прогноз \"{vars_dict.get(var)}\" из {context.user_data['doc']}-{context.user_data['year']} сценария \"{context.user_data['scenario']}\":"]
-        elif ('Базовый прогноз' in context.user_data['doc'].split('-')[0]) or (context.user_data['doc'].split('-')[0] == 'Краткосрочный прогноз') or (context.user_data['doc'].split('.')[0] in ['Бюджетная система (ОНБП)', 'Федеральный бюджет (ФЗоФБ)']) or (context.user_data['author'] == 'МЭР'):
-            text = [f"Прогноз \"{vars_dict.get(var)}\" из {context.user_data['doc']}-{context.user_data['year']}:"]
-        elif (context.user_data['author'] == 'Аналитики'):
-            text = [f"Прогноз \"{vars_dict.get(var)}\" из прогноза аналитиков перед СД {context.user_data['doc']}-{context.user_data['year']}:"]
-
-        if (context.user_data['author'] == 'Банк России'):
-            min_year = df.columns[1]
-            if context.user_data['doc'].split('-')[0] == 'Краткосрочный прогноз':
-                real = pd.read_excel('Данные/Факты.xlsx', sheet_name = 'КСП')
-                ind = real.columns.get_loc(df.columns[1])
-                q = real.columns[ind-3:ind]
-                for qi in q:
-                    r = real[real['Показатель'] == vars_dict.get(var)][qi].values[0]
-                    if pd.notna(r):
-                        r = round(float(r), 1)
-                        r = str(r).replace('.', ',')
-                        text.append(f"{qi}: {r} (факт)")
-                for col in df.columns[1:]:
-                    v = df[df.iloc[:, 0] == vars_dict.get(var)][col].values[0]
-                    v = str(v).replace('.', ',')
-                    r = real[real.iloc[:, 0] == vars_dict.get(var)][col].values[0]
-                    if ('факт' not in str(v)) and pd.notna(r):
-                        r = round(float(r), 1)
-                        r = str(r).replace('.', ',')
-                        text.append(f"{col}: {v} (факт: {r})")
-                    else:
-                        text.append(f"{col}: {v}")
-            
-                
-            elif context.user_data['doc'].split('-')[0] != 'Краткосрочный прогноз':
-                real = pd.read_excel('Данные/Факты.xlsx', sheet_name = 'Все')
-                n = real[real.iloc[:, 0] == vars_dict.get(var)]['Округление'].values[0]
-                for y in range(int(min_year)-3, int(min_year)):
-                    if y in real.columns:
-                        r = real[real.iloc[:, 0] == vars_dict.get(var)][y].values[0]
-                        if pd.notna(r):
-                            r = round(float(r), n)
-                            if n==0:
-                                r = int(r)
-                            r = str(r).replace('.', ',')
-                            text.append(f"{y}: {r} (факт)")
-                        
-                for col in df.columns[1:]:
-                    v = df[df.iloc[:, 0] == vars_dict.get(var)][col].values[0]
-                    v = str(v).replace('.', ',')
-                    r = real[real.iloc[:, 0] == vars_dict.get(var)][int(col)].values[0]
-                    if pd.notna(v):
-                        if pd.notna(r):
-                            r = round(float(r), n)
-                            if n==0:
-                                r = int(r)
-                            r = str(r).replace('.', ',')
-                            text.append(f"{col}: {v} (факт: {r})")
-                        else:
-                            text.append(f"{col}: {v}")
-
-        
-        elif (context.user_data['author'] == 'Аналитики'):
-            if var == "Долгосрочный рост ВВП":
-                col = df.columns[1]
-                v = df[df.iloc[:, 0] == vars_dict.get(var)][col].values[0]
-                v = str(v).replace('.', ',')
-                text.append(f"{v}")
-            else:
-                real = pd.read_excel('Данные/Факты.xlsx', sheet_name = 'Все')
-                min_year = df.columns[1]
-                n = real[real.iloc[:, 0] == vars_dict.get(var)]['Округление'].values[0]
-                for y in range(int(min_year)-3, int(min_year)):
-                    if y in real.columns:
-                        r = real[real.iloc[:, 0] == vars_dict.get(var)][y].values[0]
-                        if pd.notna(r):
-                            r = round(float(r), n)
-                            if n==0:
-                                r = int(r)
-                            r = str(r).replace('.', ',')
-                            text.append(f"{y}: {r} (факт)")
-                        
-                for col in df.columns[1:]:
-                    if y in real.columns:
-                        v = df[df.iloc[:, 0] == vars_dict.get(var)][col].values[0]
-                        r = real[real.iloc[:, 0] == vars_dict.get(var)][int(col)].values[0]
-                        n = real[real.iloc[:, 0] == vars_dict.get(var)]['Округление'].values[0]
-                        if pd.notna(v):
-                            v = str(v).replace('.', ',')
-                            if pd.notna(r):
-                                r = round(float(r), n)
-                                if n==0:
-                                    r = int(r)
-                                r = str(r).replace('.', ',')
-                                text.append(f"{col}: {v} (факт: {r})")
-                            else:
-                                text.append(f"{col}: {v}")
-                        else:
-                            if pd.notna(r):
-                                r = round(float(r), n)
-                                if n==0:
-                                    r = int(r)
-                                r = str(r).replace('.', ',')
-                                text.append(f"{col}: {r} (факт)")
-
-        
-        elif context.user_data['author'] == 'Минфин':
-            if context.user_data['doc'].split('.')[0] == 'Бюджетная система (ОНБП)':
-                b = 'ОНБП'
-            elif context.user_data['doc'].split('.')[0] == 'Федеральный бюджет (ФЗоФБ)':
-                b = 'ФЗоФБ'
-            
-            df1 = pd.read_excel(context.user_data['path'], sheet_name = "трлн руб")
-            df2 = pd.read_excel(context.user_data['path'], sheet_name = "% ВВП")
-
-            real1 = pd.read_excel('Данные/Факты.xlsx', sheet_name = f'{b} трлн руб')
-            real2 = pd.read_excel('Данные/Факты.xlsx', sheet_name = f'{b} % ВВП')
-            min_year = df1.columns[1]
-
-            for y in range(int(min_year)-3, int(min_year)):
-                if y in real1.columns:
-                    r_v = real1[real1.iloc[:, 0] == vars_dict.get(var)][y].values[0]
-                    if pd.notna(r_v):
-                        r_v = round(float(r_v), 1)
-                        r_v = str(r_v).replace('.', ',')
-                        text.append(f"{y}: {r_v} трлн руб. (факт)")
-
-            for col in df1.columns[1:]:
-                v = round(float(df1[df1.iloc[:, 0] == vars_dict.get(var)][col].values[0]), 1)
-                v = str(v).replace('.', ',')
-                r_v = real1[real1.iloc[:, 0] == vars_dict.get(var)][int(col)].values[0]
-                if pd.notna(r_v):
-                    r_v = round(r_v, 1)
-                    r_v = str(r_v).replace('.', ',')
-                    text.append(f"{col}: {v} трлн руб. (факт: {r_v})")
-                else:
-                    text.append(f"{col}: {v} трлн руб.")
-
-            text.append("")
-
-
-            for y in range(int(min_year)-3, int(min_year)):
-                if y in real2.columns:
-                    r_p = real2[real2.iloc[:, 0] == vars_dict.get(var)][y].values[0]
-                    if pd.notna(r_p):
-                        r_p = round(float(r_p), 1)
-                        r_p = str(r_p).replace('.', ',')
-                        text.append(f"{y}: {r_p} % ВВП (факт)")
-
-            for col in df2.columns[1:]:
-                p = round(float(df2[df2.iloc[:, 0] == vars_dict.get(var)][col].values[0]), 1)
-                p = str(p).replace('.', ',')
-                r_p = real2[real2.iloc[:, 0] == vars_dict.get(var)][int(col)].values[0]
-                if pd.notna(r_p):
-                    r_p = round(r_p, 1)
-                    r_p = str(r_p).replace('.', ',')
-                    text.append(f"{col}: {p} % ВВП (факт: {r_p})")
-                else:
-                    text.append(f"{col}: {p} % ВВП")
-
-        
-        elif context.user_data['author'] == 'МЭР':
-            real = pd.read_excel('Данные/Факты.xlsx', sheet_name = 'Все')
-            min_year = df.columns[1]
-            n = real[real.iloc[:, 0] == vars_dict.get(var)]['Округление'].values[0]
-            for y in range(int(min_year)-3, int(min_year)):
-                if y in real.columns:
-                    r = real[real.iloc[:, 0] == vars_dict.get(var)][y].values[0]
-                    if pd.notna(r):
-                        r = round(float(r), n)
-                        if n==0:
-                            r = int(r)
-                        r = str(r).replace('.', ',')
-                        text.append(f"{y}: {r} (факт)")
-                        
-            for col in df.columns[1:]:
-                v = round(float(df[df.iloc[:, 0] == vars_dict.get(var)][col].values[0]), 1)
-                v = str(v).replace('.', ',')
-                r = real[real.iloc[:, 0] == vars_dict.get(var)][int(col)].values[0]
-                if pd.notna(v):
-                    if pd.notna(r):
-                        r = round(float(r), n)
-                        if n==0:
-                            r = int(r)
-                        r = str(r).replace('.', ',')
-                        text.append(f"{col}: {v} (факт: {r})")
-                    else:
-                        text.append(f"{col}: {v}")
-
-        if (context.user_data['author'].split('-')[0] == "Банк России") and (context.user_data['var_group'] == "Платежный баланс"):
-            text.append('* В РПБ6')
-
-        all_messages.append("\n".join(text))
+        all_messages.append(index.render(var, context.user_data['doc'], context.user_data['year'], context.user_data['scenario']))
 
     
+    selection_edits.cancel(query.message.chat_id, query.message.message_id)
     await query.delete_message()
     
-    for message in all_messages:
-        await context.bot.send_message(chat_id=query.message.chat_id, text=message)
-    
     if (context.user_data['doc'].split('-')[0] == 'Краткосрочный прогноз') or (context.user_data['doc'].split('.')[0] in ['Бюджетная система (ОНБП)', 'Федеральный бюджет (ФЗоФБ)']):
         keyboard = [['Выбрать другую переменную'], ['Заново'], ['Завершить']]
     else:
@@ -834,15 +523,14 @@ async def show_selected_vars(update, context):
     
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     
-    await context.bot.send_message(
-        chat_id=query.message.chat_id,
-        text=f"Показаны прогнозы для {len(context.user_data['selected_vars'])} переменных. Выберите дальнейшее действие",
-        reply_markup=reply_markup
-    )
+    all_messages.append(f"Показаны прогнозы для {len(context.user_data['selected_vars'])} переменных. Выберите дальнейшее действие")
+    await outbox.send_many(context.bot, query.message.chat_id, all_messages, reply_markup=reply_markup)
 
 
 async def vars_received(update, context):
     log_user_action(update, "Var selected", context)
+    if update.message.text == DIFF_BUTTON:
+        return await send_release_diff(update, context, VAR)
     
     if (context.user_data['doc'].split('-')[0] == 'Краткосрочный прогноз') or (context.user_data['doc'].split('.')[0] in ['Бюджетная система (ОНБП)', 'Федеральный бюджет (ФЗоФБ)']):
         if update.message.text == '↩️Возврат к выбору документа':
@@ -854,27 +542,6 @@ async def vars_received(update, context):
             context.user_data['selected_vars'] = []
             return await scenario_received(update, context)
     
-    df = pd.read_excel(context.user_data['path'])
-    vars_list = list(df.iloc[:, 0])
-    pred_years = list(df.columns)[1:]
-    if (context.user_data['author'].split('-')[0] == "Банк России") and (context.user_data['var_group'] == "Платежный баланс"):
-        list_var_rpb = ['Импорт товаров', 'Импорт услуг', 'Импорт товаров и услуг', 
-                        'Финансовый счет (искл. резервы)', 'Сальдо ФС по госсектору', 
-                        'Сальдо ФС по частному сектору (вкл. ошибки)', 'Сальдо ФС по частному сектору']
-        list_var_change = []
-        was_rpb5 = 0
-        for vpb in df['Показатель']:
-            if vpb in list_var_rpb:
-                list_var_change.append(vpb)
-            if 'Импорт' in vpb:
-                vpb_im = vpb
-        
-        for y in pred_years:
-            if df.loc[df['Показатель'] == vpb_im, y].iloc[0] < 0:
-                was_rpb5 = 1
-                mask = df['Показатель'].isin(list_var_change)
-                df.loc[mask, y] = df.loc[mask, y] * (-1)
-    
     if context.user_data['var'] == 'all':
         keyboard = [['Заново'], ['Выбрать другой набор переменных'], ['Завершить']]
         reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -882,55 +549,18 @@ async def vars_received(update, context):
         text = f'Направляю файл c прогнозом группы переменных {context.user_data['var_group']} из {context.user_data['doc']}-{context.user_data['year']}'
         if context.user_data['var_group'] == "Платежный баланс":
             text = text + '\n*В РПБ6'
-            
-        real = pd.read_excel('Данные/Факты.xlsx', sheet_name = 'Все')
-        pred_columns = df.columns[1:]
-        min_year = df.columns[1]
-        for y in pred_columns:
-            df[y] = df[y].astype(str)
-            for i in range(len(df)):
-                var_name = df.iloc[i]['Показатель']
-                n = real[real['Показатель'] == var_name]['Округление'].values[0]
-                r = real[real['Показатель'] == var_name][int(y)].values[0]
-                v = str(df.loc[i,y]).replace('.', ',')
-                df.loc[i,y] = str(v)
-                if pd.notna(r):
-                    r = round(float(r), n)
-                    if n == 0:
-                        r = int(r)
-                    r = str(r).replace('.', ',')
-                    df.loc[i,y] = str(df.loc[i,y]) + f' (факт: {r})'
-        for i in range(1,4):
-            df.insert(1, str(int(min_year)-i) + (' (факт)'), '-')
-            for y in df.columns[1:4]:
-                for i in range(len(df)):
-                    var_name = df.iloc[i]['Показатель']
-                    n = real[real['Показатель'] == var_name]['Округление'].values[0]
-                    r = real[real['Показатель'] == var_name][int(str(y)[:4])].values[0]
-                    if pd.notna(r):
-                        r = round(float(r), n)
-                        if n == 0:
-                            r = int(r)
-                        r = str(r).replace('.', ',')
-                        df.loc[i,y] = str(r)
-                    else:
-                        if pd.notna(r):
-                            r = round(float(r), n)
-                            if n==0:
-                                r = int(r)
-                            r = str(r).replace('.', ',')
-                            text.append(f"{col}: {r} (факт)")
-            
-        excel_buffer = io.BytesIO()
-        df.to_excel(excel_buffer, index=False)
-        excel_buffer.seek(0)
-        with open(context.user_data['path'], 'rb') as file:
-            await update.message.reply_document(
-                document = excel_buffer,
-                filename = file_name,  
-                caption = text,
-                reply_markup = reply_markup
-            )
+
+        balance_of_payments = (context.user_data['author'].split('-')[0] == "Банк России") and (context.user_data['var_group'] == "Платежный баланс")
+        exported = await run_data(export_bytes, context.user_data['path'], balance_of_payments)
+        document, key = export_document(context.user_data['path'], exported)
+        message = await update.message.reply_document(
+            document = document,
+            filename = file_name,  
+            caption = text,
+            reply_markup = reply_markup
+        )
+        if message.document is not None:
+            remember_file_id(key, message.document.file_id)
     
     return await pred_received(update, context)
 
@@ -940,7 +570,7 @@ async def pred_received(update, context):
     if context.user_data['doc'].split('-')[0] == 'Краткосрочный прогноз':
         com = ['Заново', 'Выбрать другую переменную', 'Завершить']
         keyboard = [['Выбрать другую переменную'], ['Заново'], ['Завершить']]
-    elif context.user_data['var'] == 'all':
+    elif context.user_data['var'] == 'all' or context.user_data.get('scenario') == ALL_SCENARIOS:
         com = ['Заново', 'Выбрать другой набор переменных', 'Завершить']
         keyboard = [['Заново'], ['Выбрать другой набор переменных'], ['Завершить']]
     else:
@@ -983,44 +613,215 @@ async def cancel(update, context) -> int:
     context.user_data['cancelled'] = True
     return ConversationHandler.END
 
+def parse_series_args(text):
+    """
+    "[автор] <показатель> <год>" -> (автор или None, показатель, год) или None
+    """
+    parts = text.split()
+    if len(parts) < 2 or not parts[-1].isdigit():
+        return None
+    text = ' '.join(parts[:-1])
+    author = None
+    for name in catalog.authors():
+        if text.startswith(name + ' '):
+            author, text = name, text[len(name) + 1:]
+            break
+    return author, text, int(parts[-1])
+
+async def series_command(update, context):
+    log_user_action(update, "Series command", context)
+    fmt = 'csv' if update.message.text.split()[0].startswith('/series_csv') else 'xlsx'
+    parsed = parse_series_args(' '.join(context.args))
+    if parsed is None:
+        await update.message.reply_text(
+            "Использование: /series [автор] <показатель> <год>\n"
+            "Например: /series Инфляция на конец года 2024 или /series МЭР ВВП 2025\n"
+            "/series_csv - то же с выгрузкой в CSV"
+        )
+        return
+    author, indicator, year = parsed
+    name, similar = await run_data(vintages.resolve, indicator)
+    if name is None:
+        text = f"Показатель \"{indicator}\" не найден."
+        if similar:
+            text += " Похожие показатели:\n" + "\n".join(similar)
+        await update.message.reply_text(text)
+        return
+    rows = await run_data(vintages.query, name, year, author)
+    if not rows:
+        await update.message.reply_text(f"Прогнозов \"{name}\" на {year} год не найдено")
+        return
+    await outbox.send_many(context.bot, update.effective_chat.id, series_text(name, year, rows))
+    exported = await run_data(series_export, rows, fmt)
+    await update.message.reply_document(
+        document=io.BytesIO(exported),
+        filename=f'{name}-{year}.{fmt}',
+        caption=f'Все выпуски прогноза "{name}" на {year} год'
+    )
+
+async def accuracy_command(update, context):
+    log_user_action(update, "Accuracy command", context)
+    indicator = ' '.join(context.args)
+    if not indicator:
+        summary = await run_data(accuracy.summary)
+        stats = await run_data(accuracy.stats)
+        await outbox.send_many(context.bot, update.effective_chat.id, summary_text(summary))
+        name = 'Все показатели'
+    else:
+        name, similar = await run_data(vintages.resolve, indicator)
+        if name is None:
+            text = f"Показатель \"{indicator}\" не найден."
+            if similar:
+                text += " Похожие показатели:\n" + "\n".join(similar)
+            await update.message.reply_text(text)
+            return
+        stats = await run_data(accuracy.indicator, name)
+        if stats.empty:
+            await update.message.reply_text(f"Для \"{name}\" пока слишком мало прогнозов, которые можно сравнить с фактом")
+            return
+        await outbox.send_many(context.bot, update.effective_chat.id, indicator_text(name, stats))
+    exported = await run_data(stats_export, stats)
+    await update.message.reply_document(
+        document=io.BytesIO(exported),
+        filename=f'Точность-{name}.xlsx',
+        caption='Смещение, MAE и RMSE прогнозов по авторам и горизонтам'
+    )
+
+async def find_command(update, context):
+    log_user_action(update, "Find command", context)
+    text = ' '.join(context.args)
+    if not text:
+        await update.message.reply_text("Использование: /find <часть названия показателя>, например /find инфляция")
+        return
+    results = await run_data(search.find, text)
+    if not results:
+        await update.message.reply_text(f"Показатель \"{text}\" не найден")
+        return
+    lines = []
+    keyboard = []
+    for i, (name, locations) in enumerate(results, 1):
+        lines.append(f"{i}. {name}")
+        keyboard += [[InlineKeyboardButton(f"{i}. {location.author}: {location.title()}",
+                                           url=f"https://t.me/{context.bot.username}?start=g{keyboard_id(location.path)}")]
+                     for location in locations]
+    await update.message.reply_text("Найденные показатели и свежие документы с ними:\n" + "\n".join(lines),
+                                    reply_markup=InlineKeyboardMarkup(keyboard))
+
+async def inline_query(update, context):
+    query = update.inline_query.query
+    results = await run_data(inline_answers.results, normalize(query))
+    logger.info(f"Inline query from user {update.effective_user.id}: '{query}' - {len(results)} results ({inline_answers.stats_line()})")
+    await update.inline_query.answer(results, cache_time=INLINE_CACHE_SECONDS)
+
+async def session_expired(update, context) -> None:
+    if isinstance(update, Update) and update.effective_user:
+        logger.info(f"Session of user {update.effective_user.id} expired")
+        context.application.drop_user_data(update.effective_user.id)
+
+async def error_handler(update, context) -> None:
+    logger.error("Exception while handling an update", exc_info=context.error)
+    if isinstance(context.error, TimeoutError) and isinstance(update, Update) and update.effective_chat:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Не удалось подготовить ответ вовремя, попробуйте ещё раз"
+        )
+
 async def set_commands(application: Application) -> None:
     commands = [
         BotCommand("start", "Запустить бота"),
         BotCommand("cancel", "Отменить текущее действие"),
+        BotCommand("series", "Прогнозы показателя на год во всех выпусках"),
+        BotCommand("series_csv", "То же с выгрузкой в CSV"),
+        BotCommand("accuracy", "Точность прогнозов по авторам"),
+        BotCommand("find", "Найти показатель по части названия"),
     ]
     await application.bot.set_my_commands(commands)
 
 
+def warm_up() -> None:
+    """
+    Прогрев после запуска, пока бот уже принимает обновления: факты, ответы и выгрузки
+    последнего базового прогноза, общие индексы, затем наблюдатель за деревом Данные.
+    Идет в своем потоке, чтобы не занимать пул данных, который обслуживает запросы пользователей.
+    """
+    started = time.perf_counter()
+    try:
+        facts.load()
+        warm_latest_base_forecast()
+        warm_latest_exports()
+        accuracy.stats()
+        search.ensure_built()
+        release_diffs.ensure_built()
+    except Exception:
+        logger.exception("Warm-up failed, data will be loaded on first request")
+    watcher.start()
+    logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f} s")
+
+
+async def on_startup(application: Application) -> None:
+    await set_commands(application)
+    startup.phase('bot_init')
+    logger.info(f"Startup: {startup.report()}")
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
 
-async def main_async() -> None:
-    application = Application.builder().token(bot_token).build()
 
-    await set_commands(application)
-    
-    application.add_handler(CommandHandler("cancel", cancel), group=1)
+
+def build_application() -> Application:
+    builder = Application.builder().token(bot_token).concurrent_updates(PerChatUpdateProcessor(concurrent_updates)).post_init(on_startup)
+    builder = builder.request(InstrumentedRequest(connection_pool_size=256)).get_updates_request(InstrumentedRequest())
+    if telegram_api_url:
+        builder = builder.base_url(f'{telegram_api_url}/bot').base_file_url(f'{telegram_api_url}/file/bot')
+    if STATE_DB:
+        builder = builder.persistence(SQLitePersistence(STATE_DB))
+    application = builder.build()
+
+    application.add_handler(CommandHandler("cancel", instrument(cancel)), group=1)
     
-    application.add_handler(CallbackQueryHandler(handle_inline_selection, pattern="^(toggle_|show_selected|clear_selection)"))
+    application.add_handler(CallbackQueryHandler(instrument(handle_inline_selection), pattern=CALLBACK_PATTERN))
     
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
+        entry_points=[CommandHandler('start', instrument(start))],
         states={
-            AUTHOR: [MessageHandler(filters.TEXT & ~filters.COMMAND, author_received)],
-            DOC_YEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, year_received)],
-            DOC: [MessageHandler(filters.TEXT & ~filters.COMMAND, doc_type_received)],
-            SCENARIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, scenario_received)],
-            VAR_GROUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, var_group_received)],
-            VAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, vars_received)],
-            PRED: [MessageHandler(filters.TEXT & ~filters.COMMAND, pred_received)],
+            AUTHOR: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(author_received))],
+            DOC_YEAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(year_received))],
+            DOC: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(doc_type_received))],
+            SCENARIO: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(scenario_received))],
+            VAR_GROUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(var_group_received))],
+            VAR: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(vars_received))],
+            PRED: [MessageHandler(filters.TEXT & ~filters.COMMAND, instrument(pred_received))],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, instrument(session_expired))],
         },
-        fallbacks=[CommandHandler('cancel', cancel)],
+        fallbacks=[CommandHandler('cancel', instrument(cancel)), CommandHandler('start', instrument(start), filters.Regex(r'^/start g\d+$'))],
+        conversation_timeout=SESSION_TTL,
+        name='conversation',
+        persistent=bool(STATE_DB),
     )
     
+    application.add_handler(CommandHandler(["series", "series_csv"], instrument(series_command)))
+    application.add_handler(CommandHandler("accuracy", instrument(accuracy_command)))
+    application.add_handler(CommandHandler("find", instrument(find_command)))
+    application.add_handler(InlineQueryHandler(instrument(inline_query)))
     application.add_handler(conv_handler)
-    
-    await application.run_polling()
+    application.add_error_handler(error_handler)
+    if STATE_DB:
+        application.job_queue.run_repeating(evict_idle, interval=min(SESSION_TTL, 3600))
+    return application
+
+async def main_async() -> None:
+    catalog.build()
+    startup.phase('catalog')
+    loop_monitor = asyncio.get_running_loop().create_task(monitor_event_loop())
+    application = build_application()
+
+    if webhook_url:
+        from webhook import run_webhook
+        await run_webhook(application, webhook_url, webhook_port, webhook_secret)
+    else:
+        from background import keep_alive
+        keep_alive()
+        await application.run_polling()
 
 def main():
-    import asyncio
     asyncio.run(main_async())
 
 if __name__ == '__main__':
@@ -0,0 +1,238 @@
+"""
+Метрики бота в текстовом формате Prometheus (без внешних зависимостей).
+
+Счетчики и гистограммы обновляются по месту (обработчики, чтение книг, вызовы Bot API, лаг event loop),
+а счетчики кэшей и очередей, которые модули уже ведут сами, читаются в момент запроса /metrics.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.type = 'counter'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labelnames, key), value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.type = 'histogram'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    samples.append((f'{self.name}_bucket', _labels(self.labelnames, key, [('le', _number(bound))]), cumulative))
+                samples.append((f'{self.name}_bucket', _labels(self.labelnames, key, [('le', '+Inf')]), count))
+                samples.append((f'{self.name}_sum', _labels(self.labelnames, key), total))
+                samples.append((f'{self.name}_count', _labels(self.labelnames, key), count))
+        return samples
+
+
+class Callback:
+    """
+    Значение, которое вычисляется при запросе: число или {значение метки: число} для одной метки
+    """
+
+    def __init__(self, name, documentation, func, type='gauge', labelname=None):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.type = type
+        self.labelname = labelname
+
+    def samples(self):
+        value = self.func()
+        if self.labelname is None:
+            return [(self.name, '', value)]
+        return [(self.name, _labels((self.labelname,), (label,)), v) for label, v in sorted(value.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and type(existing) is type(metric) and not isinstance(metric, Callback):
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, func, type='gauge', labelname=None):
+        return self._register(Callback(name, documentation, func, type, labelname))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                logger.exception(f"Metric {metric.name} failed")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{labels} {_number(value)}" for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+HANDLER_SECONDS = registry.histogram('bot_handler_seconds', 'Время обработчика обновления', ['handler'])
+HANDLER_ERRORS = registry.counter('bot_handler_errors_total', 'Исключения в обработчиках', ['handler'])
+API_SECONDS = registry.histogram('telegram_api_seconds', 'Время вызова Bot API', ['method'])
+API_REQUESTS = registry.counter('telegram_api_requests_total', 'Вызовы Bot API по HTTP-статусу', ['method', 'status'])
+LOOP_LAG = registry.histogram('event_loop_lag_seconds', 'Опоздание пробуждения в event loop',
+                              buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+SHEET_LOADS = registry.counter('data_sheet_loads_total', 'Чтения листов с диска по источнику (store - .npz, xlsx - Excel)', ['source'])
+SHEET_LOAD_SECONDS = registry.histogram('data_sheet_load_seconds', 'Время чтения листа с диска', ['source'])
+
+
+def instrument(callback):
+    """
+    Оборачивает обработчик PTB: время выполнения и исключения по имени обработчика
+    """
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """
+    HTTPXRequest, который меряет время каждого вызова Bot API по имени метода
+    """
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            status = str(code)
+            return code, payload
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=api_method)
+            API_REQUESTS.inc(method=api_method, status=status)
+
+
+async def monitor_event_loop(interval=0.5):
+    """
+    Раз в interval секунд меряет, насколько позже заказанного event loop будит задачу
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(loop.time() - started - interval, 0.0))
+
+
+class StartupTimer:
+    """
+    Длительности этапов запуска: phase(name) закрывает этап, начатый концом предыдущего (или в момент since)
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self._mark = time.perf_counter()
+
+    def phase(self, name, since=None):
+        now = time.perf_counter()
+        self.phases[name] = now - (self._mark if since is None else since)
+        self._mark = now
+
+    def total(self):
+        return sum(self.phases.values())
+
+    def report(self):
+        return ', '.join(f"{name} {seconds:.2f} s" for name, seconds in self.phases.items()) + f" (total {self.total():.2f} s)"
+
+
+startup = StartupTimer()
+registry.callback('startup_seconds', 'Длительность этапов запуска', lambda: startup.phases, labelname='phase')
+
+
+def render():
+    return registry.render()
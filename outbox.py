@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from telegram.error import RetryAfter
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+GLOBAL_RATE = float(os.environ.get('OUTBOX_GLOBAL_RATE', 30))
+CHAT_RATE = float(os.environ.get('OUTBOX_CHAT_RATE', 1))
+CHAT_BURST = float(os.environ.get('OUTBOX_CHAT_BURST', 3))
+SEND_SECONDS = registry.histogram('outbox_send_seconds', 'Время от постановки сообщения в очередь до ответа Telegram')
+
+
+def pack_messages(texts, limit=MESSAGE_LIMIT, separator='\n\n'):
+    """
+    Склеивает тексты в как можно меньшее число сообщений не длиннее limit символов.
+    Текст длиннее limit режется по строкам (а строка длиннее limit - по limit символов).
+    """
+    pieces = []
+    for text in texts:
+        if len(text) <= limit:
+            pieces.append(text)
+            continue
+        chunk = ''
+        for line in text.split('\n'):
+            while len(line) > limit:
+                if chunk:
+                    pieces.append(chunk)
+                    chunk = ''
+                pieces.append(line[:limit])
+                line = line[limit:]
+            if chunk and len(chunk) + 1 + len(line) > limit:
+                pieces.append(chunk)
+                chunk = line
+            else:
+                chunk = f"{chunk}\n{line}" if chunk else line
+        if chunk:
+            pieces.append(chunk)
+
+    messages = []
+    for piece in pieces:
+        if messages and len(messages[-1]) + len(separator) + len(piece) <= limit:
+            messages[-1] = messages[-1] + separator + piece
+        else:
+            messages.append(piece)
+    return messages
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: rate отправок в секунду, до capacity подряд.
+    Ожидающие получают токены в порядке очереди.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def pause(self, seconds):
+        """
+        Не выдает токены ближайшие seconds секунд (после RetryAfter от Telegram)
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений: общий лимит на бота и отдельный на каждый чат (token bucket),
+    при RetryAfter отправка повторяется после паузы, а лимит чата притормаживается на эту паузу.
+    Метрики: глубина очереди (отправки, ждущие лимита или ответа), задержка отправки, повторы.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, max_retries=3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self.depth = 0
+        self.max_depth = 0
+        self.sent = 0
+        self.retries = 0
+        self.latencies = deque(maxlen=1000)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                for idle_chat in [c for c, b in self._chats.items() if b.idle()]:
+                    del self._chats[idle_chat]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def latency(self, p):
+        if not self.latencies:
+            return 0.0
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+    def stats_line(self):
+        return (f"depth={self.depth}, max_depth={self.max_depth}, sent={self.sent}, retries={self.retries}, "
+                f"p50={self.latency(50) * 1000:.0f} ms, p99={self.latency(99) * 1000:.0f} ms")
+
+    async def send(self, bot, chat_id, text, **kwargs):
+        queued = time.monotonic()
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        chat_bucket = self._chat_bucket(chat_id)
+        try:
+            for attempt in range(self.max_retries + 1):
+                await chat_bucket.acquire()
+                await self._global.acquire()
+                try:
+                    message = await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                except RetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    chat_bucket.pause(e.retry_after)
+                    logger.warning(f"Send to chat {chat_id} rate-limited, retry in {e.retry_after} s - {self.stats_line()}")
+                    continue
+                self.sent += 1
+                self.latencies.append(time.monotonic() - queued)
+                SEND_SECONDS.observe(time.monotonic() - queued)
+                return message
+        finally:
+            self.depth -= 1
+
+    async def send_many(self, bot, chat_id, texts, **kwargs):
+        """
+        Отправляет тексты, упакованные в минимум сообщений; kwargs (клавиатура) - у последнего
+        """
+        messages = pack_messages(texts)
+        for i, text in enumerate(messages):
+            await self.send(bot, chat_id, text, **(kwargs if i == len(messages) - 1 else {}))
+        logger.info(f"Sent {len(texts)} answers to chat {chat_id} in {len(messages)} messages - {self.stats_line()}")
+
+
+outbox = Outbox()
+registry.callback('outbox_depth', 'Отправки, ждущие лимита или ответа Telegram', lambda: outbox.depth)
+registry.callback('outbox_max_depth', 'Наибольшая глубина очереди отправки', lambda: outbox.max_depth)
+registry.callback('outbox_sent_total', 'Отправленные сообщения', lambda: outbox.sent, 'counter')
+registry.callback('outbox_retries_total', 'Повторы отправки после RetryAfter', lambda: outbox.retries, 'counter')
@@ -0,0 +1,358 @@
+"""
+Хранение состояния диалогов (context.user_data и состояния ConversationHandler) в SQLite.
+
+Запись чата компактная: JSON-список, где названия из каталога (автор, год, документ, сценарий,
+набор переменных, выбранные переменные) заменены номерами из таблицы names, а пути к файлам
+не хранятся вовсе и восстанавливаются по каталогу при загрузке.
+Изменения копятся в памяти и пишутся одной транзакцией; чаты, молчащие дольше SESSION_TTL_SECONDS,
+не восстанавливаются и удаляются из базы.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from catalog import catalog
+
+logger = logging.getLogger(__name__)
+
+STATE_DB = os.environ.get('STATE_DB', 'state.sqlite3')
+SESSION_TTL = float(os.environ.get('SESSION_TTL_SECONDS', 3 * 24 * 3600))
+PERSISTENCE_INTERVAL = float(os.environ.get('PERSISTENCE_INTERVAL_SECONDS', 30))
+FLUSH_DELAY = float(os.environ.get('PERSISTENCE_FLUSH_SECONDS', 1))
+
+NAME, NAMES, PLAIN, DERIVED = range(4)
+
+FIELDS = [
+    ('author', NAME), ('year', NAME), ('var', NAME), ('doc', NAME), ('doc_item', NAME),
+    ('scenario', NAME), ('var_group', NAME), ('selected_vars', NAMES),
+    ('var_selection_message_id', PLAIN), ('cancelled', PLAIN),
+    ('path_folders', DERIVED), ('path', DERIVED),
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, record TEXT NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL, key TEXT NOT NULL, state INTEGER NOT NULL, updated REAL NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE INDEX IF NOT EXISTS user_data_updated ON user_data (updated);
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated);
+"""
+
+
+def derived_paths(data):
+    """
+    Восстанавливает по каталогу пути, которые main.py кладет в user_data (path_folders и path).
+    Возвращает None, если документа уже нет в каталоге.
+    """
+    try:
+        _, path_folders = catalog.var_types(data['author'], data['year'], data['doc_item'], data['scenario'])
+        if data.get('var_group', '-') == '-':
+            path = path_folders
+        else:
+            path = catalog.group_path(data['author'], data['year'], data['doc_item'], data['scenario'], data['var_group'])
+    except (KeyError, AttributeError, FileNotFoundError):
+        return None
+    return {'path_folders': path_folders, 'path': path}
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistence для python-telegram-bot: хранит только user_data и состояния диалогов.
+    update_* не пишут в базу сразу, а копят изменения; через flush_delay секунд после первого
+    изменения все накопленное записывается одной транзакцией в отдельном потоке записи (один поток,
+    поэтому пачки ложатся в базу по порядку). Если запись не удалась, пачка возвращается в очередь.
+    Все изменения состояния объекта делаются в потоке event loop, в потоке записи - только запись в базу.
+    """
+
+    def __init__(self, path=STATE_DB, ttl=SESSION_TTL, update_interval=PERSISTENCE_INTERVAL, flush_delay=FLUSH_DELAY):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self.path = path
+        self.ttl = ttl
+        self.flush_delay = flush_delay
+        self._connection = None
+        self._lock = threading.Lock()
+        self._names = {}
+        self._values = {}
+        self._new_names = []
+        self._pending_users = {}
+        self._pending_conversations = {}
+        self._seen = {}
+        self._dropped = set()
+        self._flush_task = None
+        self._flushing = asyncio.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='state')
+
+    def _db(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(SCHEMA)
+            for name_id, value in self._connection.execute('SELECT id, value FROM names'):
+                self._names[value] = name_id
+                self._values[name_id] = value
+        return self._connection
+
+    def _name_id(self, value):
+        name_id = self._names.get(value)
+        if name_id is None:
+            name_id = len(self._names) + 1
+            self._names[value] = name_id
+            self._values[name_id] = value
+            self._new_names.append((name_id, value))
+        return name_id
+
+    def encode(self, data):
+        """
+        user_data -> компактная запись: [битовая маска полей, значения полей..., {прочие ключи}]
+        """
+        derived = derived_paths(data) or {}
+        mask = 0
+        values = []
+        extra = {}
+        kinds = dict(FIELDS)
+        for key, value in data.items():
+            if key not in kinds:
+                extra[key] = value
+        for i, (key, kind) in enumerate(FIELDS):
+            if key not in data:
+                continue
+            value = data[key]
+            if kind == NAME and isinstance(value, str):
+                value = self._name_id(value)
+            elif kind == NAMES and isinstance(value, list) and all(isinstance(v, str) for v in value):
+                value = [self._name_id(v) for v in value]
+            elif kind == PLAIN and (value is None or isinstance(value, (bool, int, float))):
+                pass
+            elif kind == DERIVED and isinstance(value, str):
+                value = None if derived.get(key) == value else self._name_id(value)
+            else:
+                extra[key] = value
+                continue
+            mask |= 1 << i
+            values.append(value)
+        record = [mask] + values
+        if extra:
+            record.append(extra)
+        return json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+
+    def decode(self, record):
+        """
+        Компактная запись -> user_data; None, если запись ссылается на исчезнувший документ
+        или на номер названия, которого нет в таблице names
+        """
+        mask, *values = json.loads(record)
+        extra = values.pop() if len(values) > bin(mask).count('1') else {}
+        data = {}
+        missing = []
+        fields = iter(values)
+        try:
+            for i, (key, kind) in enumerate(FIELDS):
+                if not mask >> i & 1:
+                    continue
+                value = next(fields)
+                if kind == NAME:
+                    value = self._values[value]
+                elif kind == NAMES:
+                    value = [self._values[v] for v in value]
+                elif kind == DERIVED:
+                    if value is None:
+                        missing.append(key)
+                        continue
+                    value = self._values[value]
+                data[key] = value
+        except KeyError as e:
+            logger.warning(f"Unknown name id {e} in stored record, record dropped")
+            return None
+        if missing:
+            derived = derived_paths(data)
+            if derived is None:
+                return None
+            for key in missing:
+                data[key] = derived[key]
+        data.update(extra)
+        return data
+
+    async def get_user_data(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            rows = self._db().execute('SELECT user_id, record, updated FROM user_data WHERE updated >= ?', (cutoff,)).fetchall()
+            expired = self._db().execute('SELECT user_id FROM user_data WHERE updated < ?', (cutoff,)).fetchall()
+        user_data = {}
+        self._dropped = {user_id for user_id, in expired}
+        for user_id, record, updated in rows:
+            data = self.decode(record)
+            if data is None:
+                self._pending_users[user_id] = None
+                self._dropped.add(user_id)
+                continue
+            user_data[user_id] = data
+            self._seen[user_id] = updated
+        logger.info(f"Restored {len(user_data)} chats from {self.path} ({len(rows) - len(user_data)} dropped)")
+        return user_data
+
+    async def get_conversations(self, name):
+        """
+        Состояния диалогов моложе ttl. Диалоги пользователей, чьи записи отброшены при загрузке
+        (устарели или не читаются), тоже отбрасываются; пользователи без записи (пустой user_data,
+        например сразу после /start) свои состояния сохраняют.
+        """
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            rows = self._db().execute('SELECT key, state FROM conversations WHERE name = ? AND updated >= ?', (name, cutoff)).fetchall()
+        conversations = {}
+        for key, state in rows:
+            key = tuple(json.loads(key))
+            if key[-1] in self._dropped:
+                self._pending_conversations[(name, key)] = None
+            else:
+                conversations[key] = state
+        return conversations
+
+    async def update_user_data(self, user_id, data):
+        now = time.time()
+        self._seen[user_id] = now
+        self._pending_users[user_id] = (self.encode(data), now) if data else None
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._seen.pop(user_id, None)
+        self._pending_users[user_id] = None
+        self._schedule_flush()
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, key)] = None if new_state is None else (new_state, time.time())
+        self._schedule_flush()
+
+    def idle_users(self):
+        """
+        Пользователи, от которых не было обновлений дольше ttl
+        """
+        cutoff = time.time() - self.ttl
+        return [user_id for user_id, seen in self._seen.items() if seen < cutoff]
+
+    def forget(self, user_id):
+        self._seen.pop(user_id, None)
+
+    def _schedule_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    def _take_batch(self):
+        batch = (self._new_names, self._pending_users, self._pending_conversations)
+        self._new_names, self._pending_users, self._pending_conversations = [], {}, {}
+        return batch
+
+    def _return_batch(self, batch):
+        """
+        Возвращает незаписанную пачку в очередь; изменения, накопленные после нее, остаются главнее
+        """
+        names, users, conversations = batch
+        self._new_names = names + self._new_names
+        self._pending_users = {**users, **self._pending_users}
+        self._pending_conversations = {**conversations, **self._pending_conversations}
+
+    async def _flush_batch(self):
+        """
+        Записывает накопленное; пачки пишутся по одной, неудачная возвращается в очередь. True, если запись прошла.
+        """
+        async with self._flushing:
+            batch = self._take_batch()
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._writer, self._write, batch)
+            except Exception:
+                logger.exception(f"State flush to {self.path} failed, {len(batch[1])} chats will be retried")
+                self._return_batch(batch)
+                return False
+        return True
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        if not await self._flush_batch():
+            self._schedule_flush()
+
+    def _write(self, batch):
+        names, users, conversations = batch
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            db = self._db()
+            with db:
+                db.executemany('INSERT OR REPLACE INTO names (id, value) VALUES (?, ?)', names)
+                db.executemany('INSERT OR REPLACE INTO user_data (user_id, record, updated) VALUES (?, ?, ?)',
+                               [(user_id, *entry) for user_id, entry in users.items() if entry is not None])
+                db.executemany('DELETE FROM user_data WHERE user_id = ?',
+                               [(user_id,) for user_id, entry in users.items() if entry is None])
+                db.executemany('INSERT OR REPLACE INTO conversations (name, key, state, updated) VALUES (?, ?, ?, ?)',
+                               [(name, json.dumps(key), *entry) for (name, key), entry in conversations.items() if entry is not None])
+                db.executemany('DELETE FROM conversations WHERE name = ? AND key = ?',
+                               [(name, json.dumps(key)) for (name, key), entry in conversations.items() if entry is None])
+                expired = db.execute('DELETE FROM user_data WHERE updated < ?', (cutoff,)).rowcount
+                expired += db.execute('DELETE FROM conversations WHERE updated < ?', (cutoff,)).rowcount
+        if users or conversations or expired:
+            logger.info(f"State flushed: {len(users)} chats, {len(conversations)} conversations, {expired} expired rows removed")
+
+    async def flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._flush_batch()
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+async def evict_idle(context):
+    """
+    Задача JobQueue: убирает из памяти пустые user_data пользователей, молчащих дольше ttl.
+    Незавершенные диалоги заканчиваются раньше по conversation_timeout (см. main.session_expired).
+    """
+    application = context.application
+    evicted = 0
+    for user_id in application.persistence.idle_users():
+        application.persistence.forget(user_id)
+        if not application.user_data.get(user_id):
+            application.drop_user_data(user_id)
+            evicted += 1
+    if evicted:
+        logger.info(f"Evicted {evicted} idle chats from memory")
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+
+from keyboards import keyboard_id
+from vintages import normalize, vintages
+
+logger = logging.getLogger(__name__)
+
+MAX_RESULTS = 8
+MAX_LOCATIONS = 5
+MIN_SCORE = 0.5
+
+
+def trigrams(text):
+    """
+    Триграммы строки с отступами по краям, чтобы короткие запросы и начала слов тоже давали совпадения
+    """
+    padded = f"  {text} "
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class IndicatorSearch:
+    """
+    Поиск показателя по части названия: триграммный индекс по названиям из всего дерева Данные
+    и сокращенным названиям кнопок (vars_dict_from_list). Индекс и места показателей в документах
+    строятся вместе с индексом выпусков и подменяются целиком, запрос не читает файлы.
+    """
+
+    def __init__(self):
+        self._data = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _build(self):
+        started = time.monotonic()
+        names, aliases = vintages.names()
+        entries = [(key, name, key) for key, name in names.items()]
+        entries += [(alias, button, key) for alias, (button, key) in aliases.items() if alias not in names]
+        index = {}
+        for i, (text, _, _) in enumerate(entries):
+            for trigram in trigrams(text):
+                index.setdefault(trigram, []).append(i)
+        locations = {}
+        for key in names:
+            for location in vintages.locations(key):
+                locations[keyboard_id(location.path)] = location
+        self._data = (entries, index, locations)
+        logger.info(f"Search index built: {len(entries)} names, {len(index)} trigrams in {time.monotonic() - started:.3f} s")
+
+    def ensure_built(self, wait=False):
+        version = vintages.version()
+        if self._version == version:
+            return
+        if not self._lock.acquire(blocking=wait or self._data is None):
+            return
+        try:
+            if self._version != version:
+                self._build()
+                self._version = version
+        finally:
+            self._lock.release()
+
+    def find(self, text, limit=MAX_RESULTS):
+        """
+        Возвращает [(название, [места показателя])], лучшие совпадения первыми
+        """
+        return [(shown, self.latest(key)) for key, shown in self.matches(text, limit)]
+
+    def matches(self, text, limit=MAX_RESULTS):
+        """
+        Возвращает [(ключ показателя, название)], лучшие совпадения первыми.
+        Подстрока в названии ценится выше совпадения по триграммам, начало названия - выше подстроки.
+        """
+        self.ensure_built()
+        query = normalize(text)
+        if not query:
+            return []
+        entries, index, _ = self._data
+        query_trigrams = trigrams(query)
+        hits = {}
+        for trigram in query_trigrams:
+            for i in index.get(trigram, ()):
+                hits[i] = hits.get(i, 0) + 1
+        best = {}
+        for i, count in hits.items():
+            entry, shown, key = entries[i]
+            score = count / len(query_trigrams)
+            if entry.startswith(query):
+                score += 2
+            elif query in entry:
+                score += 1
+            if score < MIN_SCORE:
+                continue
+            score = (score, -len(entry))
+            if key not in best or score > best[key][0]:
+                best[key] = (score, shown)
+        ranked = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+        return [(key, shown) for key, (_, shown) in ranked]
+
+    def latest(self, key, author=None, year=None):
+        """
+        Самый свежий документ каждого автора с показателем (для ОНДКП - базовый сценарий),
+        не больше MAX_LOCATIONS; author и year (год документа) сужают выбор
+        """
+        latest = {}
+        for location in vintages.locations(key):
+            if (author is None or location.author == author) and (year is None or location.year == str(year)):
+                latest.setdefault(location.author, location)
+        return list(latest.values())[:MAX_LOCATIONS]
+
+    def location(self, location_id):
+        self.ensure_built()
+        return self._data[2].get(location_id)
+
+
+search = IndicatorSearch()
@@ -0,0 +1,71 @@
+"""
+Проверка бюджета холодного старта бота, без сети.
+
+Запуск: python startup_check.py [--budget 3.0] [--runs 3]
+В отдельном процессе (каждый раз заново, как при перезапуске контейнера) импортируется main.py,
+строится каталог и приложение PTB; берется лучший из --runs запусков. Скрипт завершается с кодом 1,
+если запуск дольше бюджета или если до первого обращения к данным импортированы тяжелые модули
+(pandas, numpy, openpyxl, flask) - их загрузка должна откладываться до прогрева.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+STARTUP_BUDGET = float(os.environ.get('STARTUP_BUDGET_SECONDS', 3.0))
+DEFERRED_MODULES = ('pandas', 'numpy', 'openpyxl', 'flask')
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import {module} as main
+main.catalog.build()
+main.startup.phase('catalog')
+main.build_application()
+main.startup.phase('bot_init')
+print(json.dumps({{
+    'total': time.perf_counter() - started,
+    'phases': main.startup.phases,
+    'loaded': [name for name in {deferred!r} if name in sys.modules],
+}}))
+'''
+
+
+def probe(module='main'):
+    """
+    Один холодный запуск в новом процессе: {'total': с, 'phases': {этап: с}, 'loaded': [модули]}
+    """
+    env = dict(os.environ)
+    env.setdefault('TELEGRAM_BOT_TOKEN', '0:startup-check')
+    env.pop('STATE_DB', None)
+    result = subprocess.run([sys.executable, '-c', PROBE.format(module=module, deferred=DEFERRED_MODULES)],
+                            capture_output=True, text=True, env=env, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бюджет холодного старта')
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET, help='допустимое время запуска, с')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--module', default='main')
+    args = parser.parse_args()
+
+    runs = [probe(args.module) for _ in range(args.runs)]
+    best = min(runs, key=lambda run: run['total'])
+    phases = ', '.join(f"{name} {seconds:.2f} s" for name, seconds in best['phases'].items())
+    print(f"Startup {best['total']:.2f} s ({phases}), budget {args.budget:.2f} s")
+
+    failures = []
+    if best['total'] > args.budget:
+        failures.append(f"startup {best['total']:.2f} s is over budget {args.budget:.2f} s")
+    loaded = sorted({name for run in runs for name in run['loaded']})
+    if loaded:
+        failures.append(f"imported before first data access: {', '.join(loaded)}")
+    for line in failures:
+        print(f"  {line}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
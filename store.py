@@ -0,0 +1,207 @@
+"""
+Колоночное хранилище книг Excel из папки Данные.
+
+Сборка: python store.py build
+Каждая книга сохраняется в .npz (по массиву на столбец листа), рядом пишется manifest.json
+с размером, временем изменения и SHA-1 исходного файла. Во время работы бот читает листы
+из хранилища и возвращается к xlsx, только если запись устарела или отсутствует.
+"""
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'Данные'
+STORE_DIR = os.environ.get('DATA_STORE_DIR', '.store')
+MANIFEST = 'manifest.json'
+
+NA, NUMBER, INTEGER, TEXT = range(4)
+
+
+def sha1_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _encode_frame(df, prefix, arrays):
+    """
+    Раскладывает лист по массивам: числовые столбцы хранятся как есть,
+    смешанные - тремя массивами (тип значения, число, строка)
+    """
+    labels = list(df.columns)
+    arrays[f'{prefix}labels'] = np.array([str(c) for c in labels], dtype=str)
+    arrays[f'{prefix}label_int'] = np.array([isinstance(c, (int, np.integer)) for c in labels], dtype=bool)
+    for j, col in enumerate(labels):
+        values = df[col]
+        if pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+            arrays[f'{prefix}c{j}'] = values.to_numpy()
+            continue
+        kind = np.zeros(len(values), dtype=np.int8)
+        num = np.full(len(values), np.nan)
+        text = []
+        for i, v in enumerate(values):
+            if isinstance(v, (int, np.integer)) and not isinstance(v, bool):
+                kind[i], num[i] = INTEGER, v
+            elif isinstance(v, (float, np.floating)) and not np.isnan(v):
+                kind[i], num[i] = NUMBER, v
+            elif isinstance(v, str):
+                kind[i] = TEXT
+            text.append(v if isinstance(v, str) else '')
+        arrays[f'{prefix}k{j}'] = kind
+        arrays[f'{prefix}n{j}'] = num
+        arrays[f'{prefix}t{j}'] = np.array(text, dtype=str)
+
+
+def _decode_frame(npz, prefix):
+    labels = [int(c) if is_int else str(c) for c, is_int in zip(npz[f'{prefix}labels'], npz[f'{prefix}label_int'])]
+    data = {}
+    for j, col in enumerate(labels):
+        if f'{prefix}c{j}' in npz:
+            data[col] = npz[f'{prefix}c{j}']
+            continue
+        kind, num, text = npz[f'{prefix}k{j}'], npz[f'{prefix}n{j}'], npz[f'{prefix}t{j}']
+        values = np.empty(len(kind), dtype=object)
+        for i, k in enumerate(kind):
+            if k == INTEGER:
+                values[i] = int(num[i])
+            elif k == NUMBER:
+                values[i] = float(num[i])
+            elif k == TEXT:
+                values[i] = str(text[i])
+            else:
+                values[i] = np.nan
+        data[col] = values
+    return pd.DataFrame(data, columns=labels)
+
+
+class ColumnStore:
+    """
+    Чтение листов из собранного хранилища с проверкой актуальности по manifest.json
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self._manifest = None
+        self._manifest_mtime = None
+        self._lock = threading.Lock()
+
+    def _manifest_entries(self):
+        manifest_path = os.path.join(self.store_dir, MANIFEST)
+        try:
+            mtime = os.stat(manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return {}
+        if mtime != self._manifest_mtime:
+            with open(manifest_path, encoding='utf-8') as f:
+                self._manifest = json.load(f)
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def fresh_entry(self, path):
+        """
+        Возвращает запись манифеста, если она соответствует файлу, иначе None.
+        Сначала сравниваются размер и время изменения, при расхождении - SHA-1 файла.
+        """
+        with self._lock:
+            entry = self._manifest_entries().get(os.path.normpath(path))
+            if entry is None:
+                return None
+            st = os.stat(path)
+            if entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+                return entry
+            if entry['size'] == st.st_size and entry['sha1'] == sha1_file(path):
+                entry['mtime_ns'] = st.st_mtime_ns
+                return entry
+            return None
+
+    def load(self, path, sheet_name=0):
+        """
+        Возвращает лист (или словарь всех листов при sheet_name=None) из хранилища,
+        либо None, если хранилище не содержит актуальной копии файла
+        """
+        entry = self.fresh_entry(path)
+        if entry is None:
+            return None
+        sheets = entry['sheets']
+        with np.load(os.path.join(self.store_dir, entry['store']), allow_pickle=False) as npz:
+            if sheet_name is None:
+                return {name: _decode_frame(npz, f's{i}_') for i, name in enumerate(sheets)}
+            if isinstance(sheet_name, int):
+                i = sheet_name
+            elif sheet_name in sheets:
+                i = sheets.index(sheet_name)
+            else:
+                return None
+            return _decode_frame(npz, f's{i}_')
+
+    def build(self, root=DATA_DIR):
+        """
+        Конвертирует все книги дерева root в хранилище; неизменившиеся файлы пропускаются
+        """
+        old = dict(self._manifest_entries())
+        manifest = {}
+        converted = 0
+        for dirpath, _, filenames in os.walk(root):
+            for name in sorted(filenames):
+                if not name.endswith('.xlsx') or name.startswith('~$'):
+                    continue
+                path = os.path.normpath(os.path.join(dirpath, name))
+                st = os.stat(path)
+                sha1 = sha1_file(path)
+                store_name = os.path.splitext(path)[0] + '.npz'
+                entry = old.get(path)
+                if entry is not None and entry['sha1'] == sha1 and os.path.exists(os.path.join(self.store_dir, store_name)):
+                    entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+                    manifest[path] = entry
+                    continue
+
+                sheets = pd.read_excel(path, sheet_name=None)
+                arrays = {}
+                for i, df in enumerate(sheets.values()):
+                    _encode_frame(df, f's{i}_', arrays)
+                target = os.path.join(self.store_dir, store_name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                np.savez_compressed(target, **arrays)
+                manifest[path] = {
+                    'store': store_name,
+                    'sheets': list(sheets),
+                    'size': st.st_size,
+                    'mtime_ns': st.st_mtime_ns,
+                    'sha1': sha1,
+                }
+                converted += 1
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        tmp = os.path.join(self.store_dir, MANIFEST + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, os.path.join(self.store_dir, MANIFEST))
+        logger.info(f"Store built in {self.store_dir}: {converted} converted, {len(manifest) - converted} unchanged")
+        return manifest
+
+
+columnar = ColumnStore()
+
+
+def load(path, sheet_name=0):
+    return columnar.load(path, sheet_name=sheet_name)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2 or sys.argv[1] != 'build':
+        print('Использование: python store.py build [папка с данными]')
+        sys.exit(1)
+    columnar.build(sys.argv[2] if len(sys.argv) > 2 else DATA_DIR)
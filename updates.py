@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обрабатывает обновления параллельно (не больше max_concurrent_updates одновременно),
+    но обновления одного чата - строго по очереди, в порядке поступления.
+    Так состояния ConversationHandler и выбор переменных в handle_inline_selection не гоняются.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._chats = {}
+
+    async def process_update(self, update, coroutine):
+        # Очередь чата занимается до общего лимита, чтобы ждущие обновления одного чата
+        # не держали слоты, нужные другим чатам
+        chat = getattr(update, 'effective_chat', None)
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._chats.get(chat.id)
+        if entry is None:
+            entry = self._chats[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[chat.id]
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,319 @@
+import io
+import logging
+import threading
+import time
+
+from answers import BUDGET_DOCS, format_fact, normalize_balance_of_payments, vars_dict_from_list
+from cache import file_signature, load_sheet
+from catalog import catalog
+from facts import facts
+from lazy import lazy_import
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ['Автор', 'Год документа', 'Документ', 'Сценарий', 'Набор переменных', 'Единицы', 'Столбец', 'Значение']
+
+
+def normalize(name):
+    return ' '.join(str(name).split()).casefold()
+
+
+def column_year(col):
+    """
+    Год столбца прогноза или None для квартальных столбцов ('1к24')
+    """
+    text = str(col)
+    return int(text[:4]) if text[:4].isdigit() else None
+
+
+class Vintage:
+    """
+    Значение показателя из одного выпуска: автор, год и название документа, сценарий (для ОНДКП),
+    набор переменных, единицы (для Минфина), столбец и значение. rank задает порядок выпусков.
+    """
+
+    __slots__ = ('author', 'year', 'doc', 'scenario', 'group', 'unit', 'column', 'value', 'rank')
+
+    def __init__(self, author, year, doc, scenario, group, unit, column, value, rank):
+        self.author = author
+        self.year = year
+        self.doc = doc
+        self.scenario = scenario
+        self.group = group
+        self.unit = unit
+        self.column = column
+        self.value = value
+        self.rank = rank
+
+    def release(self):
+        release = f"{self.year} {self.doc}"
+        if self.scenario != '-':
+            release += f" ({self.scenario})"
+        if self.unit:
+            release += f", {self.unit}"
+        return release
+
+
+class Location:
+    """
+    Место показателя в дереве: документ, сценарий и набор переменных (как их выбирают в диалоге)
+    и путь к файлу; для файлов без наборов (Минфин, краткосрочный прогноз) group = '-'
+    """
+
+    __slots__ = ('author', 'year', 'doc', 'doc_item', 'scenario', 'group', 'path', 'rank')
+
+    def __init__(self, author, year, doc, doc_item, scenario, group, path, rank):
+        self.author = author
+        self.year = year
+        self.doc = doc
+        self.doc_item = doc_item
+        self.scenario = scenario
+        self.group = group
+        self.path = path
+        self.rank = rank
+
+    def __eq__(self, other):
+        return isinstance(other, Location) and self.path == other.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def title(self):
+        title = f"{self.doc}-{self.year}"
+        if self.scenario != '-':
+            title += f" ({self.scenario})"
+        if self.group != '-':
+            title += f": {self.group}"
+        return title
+
+
+class _IndexData:
+    """
+    Одна версия индекса; VintageIndex подменяет ее целиком
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.names = {}
+        self.aliases = {}
+        self.alias_names = {}
+        self.locations = {}
+        self.frame = None
+
+
+class VintageIndex:
+    """
+    Обратный индекс по всему дереву Данные: показатель -> год прогноза -> значения из всех выпусков.
+    Значения берутся из годовых столбцов (квартальные столбцы краткосрочных прогнозов не входят),
+    а для поиска запоминается, в каких документах и наборах встречается каждый показатель.
+    Перестраивается при изменении каталога: заново читаются только изменившиеся файлы,
+    а готовый индекс подменяется целиком, так что читатели видят либо старую, либо новую версию.
+    """
+
+    def __init__(self):
+        self._data = None
+        self._parsed = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _rows(self, parsed, path, sheet_name=0, balance_of_payments=False):
+        """
+        Строки файла в виде [(показатель, [(столбец, год, значение)])]; файл читается, только если изменился
+        """
+        key = (path, sheet_name)
+        signature = file_signature(path)
+        cached = self._parsed.get(key)
+        if cached is None or cached[0] != signature:
+            # мимо кэша книг, чтобы полный обход дерева не вытеснял из него рабочие файлы
+            df = load_sheet(path, sheet_name=sheet_name)
+            if balance_of_payments:
+                df = normalize_balance_of_payments(df)
+            columns = [(col, column_year(col)) for col in df.columns[1:]]
+            rows = []
+            for name, values in zip(df.iloc[:, 0], df.iloc[:, 1:].itertuples(index=False, name=None)):
+                if not isinstance(name, str):
+                    continue
+                row = []
+                for (col, year), value in zip(columns, values):
+                    value = pd.to_numeric(value, errors='coerce')
+                    if year is not None and pd.notna(value):
+                        row.append((col, year, float(value)))
+                rows.append((name, row))
+            cached = (signature, rows)
+        parsed[key] = cached
+        return cached[1]
+
+    @staticmethod
+    def _add(data, rows, vintage, location, unit=''):
+        for name, values in rows:
+            key = normalize(name)
+            data.names.setdefault(key, name)
+            locations = data.locations.setdefault(key, [])
+            if location not in locations:
+                locations.append(location)
+            years = data.index.setdefault(key, {})
+            for col, year, value in values:
+                years.setdefault(year, []).append(Vintage(*vintage[:5], unit, col, value, vintage[5]))
+            for button, original in vars_dict_from_list([name]).items():
+                if button != original:
+                    data.aliases[normalize(button)] = key
+                    data.alias_names[normalize(button)] = button
+
+    def _build(self):
+        started = time.monotonic()
+        data = _IndexData()
+        parsed = {}
+        for author in catalog.authors():
+            for year in catalog.years(author):
+                for rank, document in enumerate(catalog.documents(author, year)):
+                    release = (int(year), rank)
+                    if author == 'Минфин' or document.item.partition('-')[0] == 'Краткосрочный прогноз':
+                        location = Location(author, year, document.label, document.item, '-', '-', document.path, release)
+                        if author == 'Минфин':
+                            for unit in ('трлн руб', '% ВВП'):
+                                self._add(data, self._rows(parsed, document.path, unit),
+                                          (author, year, document.label, '-', BUDGET_DOCS.get(document.label, document.label), release), location, unit)
+                        else:
+                            self._add(data, self._rows(parsed, document.path), (author, year, document.label, '-', '-', release), location)
+                        continue
+                    for scenario, groups in sorted(document.scenarios.items()):
+                        for group, path in sorted(groups.items()):
+                            rows = self._rows(parsed, path, balance_of_payments=author == 'Банк России' and group == 'Платежный баланс')
+                            location = Location(author, year, document.label, document.item, scenario, group, path, release)
+                            self._add(data, rows, (author, year, document.label, scenario, group, release), location)
+        for years in data.index.values():
+            for vintages in years.values():
+                vintages.sort(key=lambda v: (v.author, v.rank, v.scenario, v.unit))
+        reread = sum(1 for key, entry in parsed.items() if self._parsed.get(key) is not entry)
+        self._parsed = parsed
+        self._data = data
+        logger.info(f"Vintage index built: {len(data.index)} indicators from {len(parsed)} sheets "
+                    f"({reread} re-read) in {time.monotonic() - started:.2f} s")
+
+    def ensure_built(self, wait=False):
+        """
+        Перестраивает индекс, если изменился каталог. Пока идет перестройка в другом потоке,
+        запросы обслуживаются прежней версией индекса (wait=True - дождаться новой)
+        """
+        version = catalog.version()
+        if self._version == version:
+            return
+        if not self._lock.acquire(blocking=wait or self._data is None):
+            return
+        try:
+            if self._version != version:
+                self._build()
+                self._version = version
+        finally:
+            self._lock.release()
+
+    def resolve(self, text):
+        """
+        Возвращает (название показателя, []) или (None, список похожих названий)
+        """
+        self.ensure_built()
+        data = self._data
+        key = normalize(text)
+        key = data.aliases.get(key, key)
+        if key in data.index:
+            return data.names[key], []
+        similar = [name for k, name in data.names.items() if key in k]
+        return None, sorted(similar)[:10]
+
+    def query(self, indicator, year, author=None):
+        """
+        Все выпуски прогноза показателя на год year в порядке выхода (по авторам)
+        """
+        self.ensure_built()
+        data = self._data
+        key = normalize(indicator)
+        key = data.aliases.get(key, key)
+        vintages = data.index.get(key, {}).get(int(year), [])
+        if author is not None:
+            vintages = [v for v in vintages if v.author == author]
+        return vintages
+
+    def frame(self):
+        """
+        Все значения индекса одной таблицей (для пакетной аналитики по всему корпусу)
+        """
+        self.ensure_built()
+        data = self._data
+        if data.frame is None:
+            rows = [(data.names[key], v.author, int(v.year), v.doc, v.scenario, v.group, v.unit, year, v.value, v.rank)
+                    for key, years in data.index.items() for year, vintages in years.items() for v in vintages]
+            data.frame = pd.DataFrame(rows, columns=['indicator', 'author', 'doc_year', 'doc', 'scenario', 'group', 'unit',
+                                                     'target', 'value', 'rank'])
+        return data.frame
+
+    def version(self):
+        self.ensure_built()
+        return self._version
+
+    def names(self):
+        """
+        Возвращает {нормализованное название: название} всех показателей
+        и {нормализованное название кнопки: (название кнопки, ключ показателя)} сокращений из vars_dict_from_list
+        """
+        self.ensure_built()
+        data = self._data
+        return dict(data.names), {alias: (data.alias_names[alias], key) for alias, key in data.aliases.items()}
+
+    def locations(self, key):
+        """
+        Документы и наборы переменных, где встречается показатель, от новых к старым
+        """
+        self.ensure_built()
+        return sorted(self._data.locations.get(key, []), key=lambda loc: (loc.rank, loc.scenario == 'Базовый'), reverse=True)
+
+    def years(self, indicator):
+        self.ensure_built()
+        data = self._data
+        key = normalize(indicator)
+        return sorted(data.index.get(data.aliases.get(key, key), {}))
+
+
+vintages = VintageIndex()
+
+
+def series_text(name, year, rows):
+    """
+    Текст ответа: выпуски по авторам и факт за год, если он уже известен
+    """
+    n = facts.rounding(name, default=1)
+    blocks = [f"Прогнозы \"{name}\" на {year} год во всех выпусках:"]
+    author = None
+    lines = []
+    for v in rows:
+        if v.author != author:
+            if lines:
+                blocks.append("\n".join(lines))
+            author = v.author
+            lines = [f"{author}:"]
+        lines.append(f"{v.release()}: {format_fact(v.value, n)}")
+    if lines:
+        blocks.append("\n".join(lines))
+    real = facts.fact('Все', name, int(year))
+    if pd.notna(real):
+        blocks.append(f"Факт за {year}: {format_fact(real, n)}")
+    return blocks
+
+
+def series_frame(rows):
+    return pd.DataFrame([(v.author, v.year, v.doc, v.scenario, v.group, v.unit, str(v.column), v.value) for v in rows],
+                        columns=EXPORT_COLUMNS)
+
+
+def series_export(rows, fmt='xlsx'):
+    """
+    Выгрузка выпусков в xlsx или csv (csv - с ';' и десятичной запятой, как ждет русский Excel)
+    """
+    buffer = io.BytesIO()
+    df = series_frame(rows)
+    if fmt == 'csv':
+        buffer.write(df.to_csv(index=False, sep=';', decimal=',').encode('utf-8-sig'))
+    else:
+        df.to_excel(buffer, index=False)
+    return buffer.getvalue()
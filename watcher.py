@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+import time
+
+from accuracy import accuracy
+from answers import refresh_indexes, warm_latest_base_forecast
+from cache import workbooks
+from catalog import DATA_DIR, catalog
+from diffs import release_diffs
+from export import refresh_exports, warm_latest_exports
+from facts import FACTS_PATH, facts
+from keyboards import refresh_keyboards
+from metrics import registry
+from search import search
+from vintages import vintages
+
+logger = logging.getLogger(__name__)
+
+DATA_WATCH_INTERVAL = float(os.environ.get('DATA_WATCH_SECONDS', 5))
+
+
+def take_snapshot(root=DATA_DIR):
+    """
+    Возвращает {путь: (время изменения, размер)} всех папок и книг дерева (кроме временных файлов Excel)
+    """
+    snapshot = {}
+    for dirpath, _, filenames in os.walk(root):
+        st = os.stat(dirpath)
+        snapshot[dirpath] = (st.st_mtime_ns, 0)
+        for name in filenames:
+            if name.startswith('~$'):
+                continue
+            path = f"{dirpath}/{name}"
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+
+class DataWatcher:
+    """
+    Следит за деревом Данные в фоновом потоке (опрос времени изменения и размера раз в interval секунд)
+    и, когда новые файлы докопированы (два одинаковых снимка подряд), заранее перестраивает затронутое:
+    годы каталога, листы в кэше, факты, индексы документов, клавиатуры выбора, готовые выгрузки, общие индексы
+    и изменения между выпусками.
+    Каждая структура подменяется целиком, поэтому диалоги видят либо прежнюю, либо новую версию данных.
+    """
+
+    def __init__(self, root=DATA_DIR, interval=DATA_WATCH_INTERVAL):
+        self.root = root
+        self.interval = interval
+        self.reloads = 0
+        self.last_reload = None
+        self._applied = None
+        self._pending = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._applied = take_snapshot(self.root)
+        catalog.refresh_interval = None
+        self._thread = threading.Thread(target=self._run, name='data-watcher', daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {self.root} every {self.interval:g} s: {len(self._applied)} paths")
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception(f"Reload of {self.root} failed, will retry")
+
+    def check(self):
+        snapshot = take_snapshot(self.root)
+        if snapshot == self._applied:
+            self._pending = None
+            return
+        if snapshot != self._pending:
+            self._pending = snapshot
+            return
+        changed = sorted(path for path in snapshot.keys() | self._applied.keys()
+                         if snapshot.get(path) != self._applied.get(path))
+        self.reload(changed)
+        self._applied = snapshot
+        self._pending = None
+
+    def reload(self, changed):
+        started = time.monotonic()
+        files = [path for path in changed if path.endswith('.xlsx')]
+        for path in files:
+            workbooks.invalidate(path)
+        version = catalog.version()
+        catalog.build()
+        if catalog.version() == version and any(path != FACTS_PATH for path in files):
+            catalog.mark_changed()
+        facts.version()
+        refresh_indexes(files)
+        refresh_keyboards(files)
+        refresh_exports(files)
+        vintages.ensure_built(wait=True)
+        search.ensure_built(wait=True)
+        accuracy.stats(wait=True)
+        release_diffs.ensure_built(wait=True)
+        warm_latest_base_forecast()
+        warm_latest_exports()
+        self.reloads += 1
+        self.last_reload = time.time()
+        logger.info(f"Data reloaded in {time.monotonic() - started:.2f} s: {len(changed)} changed paths "
+                    f"({', '.join(changed[:5])}{', ...' if len(changed) > 5 else ''})")
+
+
+watcher = DataWatcher()
+registry.callback('data_reloads_total', 'Перезагрузки дерева Данные наблюдателем', lambda: watcher.reloads, 'counter')
@@ -0,0 +1,59 @@
+import logging
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Route
+from telegram import Update
+
+from metrics import CONTENT_TYPE, render
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = '/telegram'
+
+
+def create_app(application, secret_token=None):
+    """
+    ASGI-приложение: принимает обновления Telegram на WEBHOOK_PATH
+    и отвечает "I'm alive" на / и метриками Prometheus на /metrics (вместо Flask из background.py)
+    """
+    async def telegram(request: Request) -> Response:
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return Response(status_code=403)
+        update = Update.de_json(await request.json(), application.bot)
+        await application.update_queue.put(update)
+        return Response()
+
+    async def home(request: Request) -> PlainTextResponse:
+        return PlainTextResponse("I'm alive")
+
+    async def metrics(request: Request) -> Response:
+        return Response(render(), media_type=CONTENT_TYPE)
+
+    return Starlette(routes=[
+        Route(WEBHOOK_PATH, telegram, methods=['POST']),
+        Route('/', home, methods=['GET']),
+        Route('/metrics', metrics, methods=['GET']),
+    ])
+
+
+async def run_webhook(application, url, port=80, secret_token=None):
+    """
+    Запускает бота в режиме webhook на одном сервере uvicorn в текущем event loop
+    """
+    server = uvicorn.Server(uvicorn.Config(
+        app=create_app(application, secret_token),
+        host='0.0.0.0',
+        port=port,
+        use_colors=False,
+    ))
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.bot.set_webhook(url=f'{url}{WEBHOOK_PATH}', allowed_updates=Update.ALL_TYPES, secret_token=secret_token)
+        await application.start()
+        logger.info(f"Webhook mode: listening on port {port}, webhook {url}{WEBHOOK_PATH}")
+        await server.serve()
+        await application.stop()
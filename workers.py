@@ -0,0 +1,38 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DATA_WORKERS = int(os.environ.get('DATA_WORKERS', 4))
+DATA_TIMEOUT = float(os.environ.get('DATA_TIMEOUT_SECONDS', 30))
+
+executor = ThreadPoolExecutor(max_workers=DATA_WORKERS, thread_name_prefix='data')
+
+_inflight = {}
+
+
+async def run_data(func, *args, timeout=DATA_TIMEOUT):
+    """
+    Выполняет блокирующую работу с данными (pandas/openpyxl) в пуле потоков, не занимая event loop.
+    Одновременные вызовы с одинаковыми (хешируемыми) аргументами ждут один общий результат.
+    По истечении timeout секунд вызывающий получает TimeoutError, а сама задача дорабатывает в пуле.
+    """
+    key = (func, args)
+    try:
+        future = _inflight.get(key)
+    except TypeError:
+        return await asyncio.wait_for(asyncio.get_running_loop().run_in_executor(executor, func, *args), timeout)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        _inflight[key] = future
+
+        def forget(done, key=key):
+            if _inflight.get(key) is done:
+                del _inflight[key]
+
+        future.add_done_callback(forget)
+    else:
+        logger.info(f"Joined in-flight data request: {getattr(func, '__name__', func)}{args}")
+    return await asyncio.wait_for(asyncio.shield(future), timeout)